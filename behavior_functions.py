@@ -1,7 +1,8 @@
-from intelligence import statement, conditional
+from intelligence import statement, conditional, batch_of
 from sim_entities import Plant, Bot, MobileSignal, StaticSignal, Signal
 
 from numpy.random import random_integers, ranf
+import numpy as np
 import math
 
 
@@ -13,20 +14,25 @@ import math
 # TODO: Include a decorator for comparing two bots for champion selection
 
 def _check_detected_entity_type(signal, entity_type, exclude=None):
-    if signal and signal.detected_objects and signal.energy > 0:
-        for item in signal.detected_objects:
-            if isinstance(item, entity_type) and item is not exclude:
+    if signal and signal.energy > 0:
+        for item in signal.detected_of(entity_type):
+            if item is not exclude:
                 return item
     return False
 
 
-@conditional()
+@conditional(pure=True)
 def reproduce_possible(bot):
     if bot.energy > bot.child_investment:
         return True
     return False
 
 
+@batch_of(reproduce_possible)
+def _reproduce_possible_batch(store, rows, bots):
+    return store.columns['energy'][rows] > store.columns['child_investment'][rows]
+
+
 @statement(seed_required=True)
 def create_clone(bot):
     # Let's require the bot to have energy before it can do this
@@ -34,10 +40,11 @@ def create_clone(bot):
         # First the parent bot must pay an energy tax
         bot.world.drain_energy_from_entity(10, bot)
         child_behavior = bot.behavior.return_tree_copy()
-        # Allow mutation
-        if random_integers(1, 100) < 40:
-            child_behavior.mutate_behavior()
-        child = Bot(bot.x + random_integers(-3, 3), bot.y + random_integers(-3, 3),
+        # Allow mutation, which the world does for all of the tick's offspring at once
+        engine = bot.world.mutation_engine
+        mutate = engine.below(100) < 39
+        offset_x, offset_y = engine.below(7) - 3, engine.below(7) - 3
+        child = Bot(bot.x + offset_x, bot.y + offset_y,
                     generation_number=bot.generation_number + 1, behavior_graph=child_behavior)
         # For now just start at the first node. Setting it to a random one could be interesting as well.
         child.behavior.set_entry_node(child.behavior.behavior_nodes[0])
@@ -46,7 +53,8 @@ def create_clone(bot):
         child.child_investment = bot.child_investment
         bot.number_children += 1
         # print("%s spawned %s" % (str(bot), str(child)))
-        bot.world.add_entity(child)
+        if bot.world.add_entity(child) and mutate:
+            bot.world.mutate_later(child)
 
 
 @statement()
@@ -56,7 +64,7 @@ def launch_signal(bot):
     bot.world.transfer_energy_between_entities(10, donor=bot, recipient=bot.signal)
 
 
-@conditional()
+@conditional(pure=True)
 def signal_exists(bot):
     if bot.signal:
         return True
@@ -68,6 +76,11 @@ def wait(bot):
     pass
 
 
+@batch_of(wait)
+def _wait_batch(store, rows, bots):
+    pass
+
+
 @conditional()
 def has_signal_found_plant(bot):
     plant = _check_detected_entity_type(bot.signal, Plant)
@@ -85,7 +98,18 @@ def move_towards_target(bot):
         bot.y += unit_vector[1] * bot.speed
 
 
-@conditional()
+@batch_of(move_towards_target)
+def _move_towards_target_batch(store, rows, bots):
+    columns = store.columns
+    rows = rows[~np.isnan(columns['target_x'][rows])]
+    x, y, speed = columns['x'][rows], columns['y'][rows], columns['speed'][rows]
+    target_x, target_y = columns['target_x'][rows], columns['target_y'][rows]
+    unit_x, unit_y = bots[0].world.get_unit_vectors_to_points(x, y, target_x, target_y)
+    columns['x'][rows] = x + unit_x * speed
+    columns['y'][rows] = y + unit_y * speed
+
+
+@conditional(pure=True)
 def target_nearby(bot):
     if bot.target_point:
         if math.sqrt(((bot.target_point[0] - bot.x) ** 2) + ((bot.target_point[1] - bot.y) ** 2)) <= 2:
@@ -93,18 +117,19 @@ def target_nearby(bot):
     return False
 
 
+@batch_of(target_nearby)
+def _target_nearby_batch(store, rows, bots):
+    columns = store.columns
+    x_diff = columns['target_x'][rows] - columns['x'][rows]
+    y_diff = columns['target_y'][rows] - columns['y'][rows]
+    # Comparisons with the NaN of a missing target are False
+    return np.sqrt((x_diff ** 2) + (y_diff ** 2)) <= 2
+
+
 @statement()
 def eat_nearby_plants(bot):
-    if bot.signal:
-        bot.signal.dead = True
-    bot.signal = StaticSignal(bot.x, bot.y, bot, color=(120, 240, 130), max_age=2)
-    bot.signal.diameter = 6
-    bot.world.transfer_energy_between_entities(3, donor=bot, recipient=bot.signal)
-    bot.signal.step()
-    if bot.signal.detected_objects:
-        for entity in bot.signal.detected_objects:
-            if isinstance(entity, Plant):
-                bot.world.transfer_energy_between_entities(entity.energy, donor=entity, recipient=bot)
+    for entity in bot.world.query_around(bot, 3, kinds=(Plant,), cost=3, color=(120, 240, 130)):
+        bot.world.transfer_energy_between_entities(entity.energy, donor=entity, recipient=bot)
 
 
 #######################################################
@@ -130,18 +155,18 @@ def set_random_target(bot):
     bot.target_point = bot.x + random_integers(-100, 100), bot.y + random_integers(-100, 100)
 
 
+@batch_of(set_random_target)
+def _set_random_target_batch(store, rows, bots):
+    columns = store.columns
+    offsets = np.random.randint(-100, 101, size=(len(rows), 2))
+    columns['target_x'][rows] = columns['x'][rows] + offsets[:, 0]
+    columns['target_y'][rows] = columns['y'][rows] + offsets[:, 1]
+
+
 @statement(seed_eligible=False)
 def eat_nearby_bots(bot):
-    if bot.signal:
-        bot.signal.dead = True
-    bot.signal = StaticSignal(bot.x, bot.y, bot, color=(240, 90, 90), max_age=2)
-    bot.signal.diameter = 6
-    bot.world.transfer_energy_between_entities(2, donor=bot, recipient=bot.signal)
-    bot.signal.step()
-    if bot.signal.detected_objects:
-        for entity in bot.signal.detected_objects:
-            if isinstance(entity, Bot) and entity is not bot:
-                bot.world.transfer_energy_between_entities(entity.energy, donor=entity, recipient=bot)
+    for entity in bot.world.query_around(bot, 3, kinds=(Bot,), cost=2, color=(240, 90, 90)):
+        bot.world.transfer_energy_between_entities(entity.energy, donor=entity, recipient=bot)
 
 
 @conditional(seed_eligible=False)
@@ -164,15 +189,10 @@ def has_signal_found_signal(bot):
 
 @statement(seed_eligible=False)
 def eat_nearby_signal(bot):
-    if bot.signal:
-        bot.signal.dead = True
-    bot.signal = StaticSignal(bot.x, bot.y, bot, color=(130, 130, 230), max_age=2)
-    bot.signal.diameter = 6
-    bot.world.transfer_energy_between_entities(2, donor=bot, recipient=bot.signal)
-    bot.signal.step()
-    entity = _check_detected_entity_type(bot.signal, Signal, exclude=bot.signal)
-    if entity:
-        bot.world.transfer_energy_between_entities(entity.energy, donor=entity, recipient=bot)
+    for entity in bot.world.query_around(bot, 3, kinds=(Signal,), cost=2, color=(130, 130, 230)):
+        if entity is not bot.signal:
+            bot.world.transfer_energy_between_entities(entity.energy, donor=entity, recipient=bot)
+            break
 
 
 @statement(seed_eligible=False)
@@ -187,13 +207,18 @@ def random_choice(bot):
     return random_integers(0, 1)
 
 
-@conditional()
+@conditional(pure=True)
 def very_low_energy(bot):
     if bot.energy < 100:
         return True
     return False
 
 
+@batch_of(very_low_energy)
+def _very_low_energy_batch(store, rows, bots):
+    return store.columns['energy'][rows] < 100
+
+
 @statement(seed_eligible=False)
 def set_target_to_signal_origin(bot):
     item = _check_detected_entity_type(bot.signal, Signal, exclude=bot.signal)
@@ -213,17 +238,17 @@ def _check_message_type(bot, message_type):
     return True if item and item.message_signal_type == message_type else False
 
 
-@conditional(seed_eligible=False)
+@conditional(seed_eligible=False, pure=True)
 def detected_message_zero(bot):
     return _check_message_type(bot, 0)
 
 
-@conditional(seed_eligible=False)
+@conditional(seed_eligible=False, pure=True)
 def detected_message_one(bot):
     return _check_message_type(bot, 1)
 
 
-@conditional(seed_eligible=False)
+@conditional(seed_eligible=False, pure=True)
 def detected_message_two(bot):
     return _check_message_type(bot, 2)
 
@@ -233,6 +258,11 @@ def set_random_signal_direction(bot):
     bot.signal_direction = ranf() * 2 * math.pi
 
 
+@batch_of(set_random_signal_direction)
+def _set_random_signal_direction_batch(store, rows, bots):
+    store.columns['signal_direction'][rows] = ranf(len(rows)) * 2 * math.pi
+
+
 @statement()
 def move_towards_signal_direction(bot):
     if bot.signal_direction:
@@ -241,21 +271,23 @@ def move_towards_signal_direction(bot):
         bot.y += unit_vector[1] * bot.speed
 
 
+@batch_of(move_towards_signal_direction)
+def _move_towards_signal_direction_batch(store, rows, bots):
+    columns = store.columns
+    rows = rows[columns['signal_direction'][rows] != 0]
+    direction, speed = columns['signal_direction'][rows], columns['speed'][rows]
+    columns['x'][rows] += np.cos(direction) * speed
+    columns['y'][rows] += np.sin(direction) * speed
+
+
 @statement()
 def surround_push(bot):
-    signal = StaticSignal(bot.x, bot.y, bot, color=(205, 205, 40), max_age=2)
-    bot.world.transfer_energy_between_entities(80, donor=bot, recipient=signal)
-    signal.diameter = 18
-    bot.signal = signal
-    bot.signal.step()
-    if signal.detected_objects:
-        for item in signal.detected_objects:
-            if isinstance(item, Bot) and item is not bot:
-                dx, dy = item.x - signal.x, item.y - signal.y
-                radians = math.atan2(dy, dx)
-                radius = signal.diameter / 2
-                item.x = signal.x + (radius * math.cos(radians))
-                item.y = signal.y + (radius * math.sin(radians))
+    radius = 9
+    for item in bot.world.query_around(bot, radius, kinds=(Bot,), cost=80, color=(205, 205, 40)):
+        dx, dy = item.x - bot.x, item.y - bot.y
+        radians = math.atan2(dy, dx)
+        item.x = bot.x + (radius * math.cos(radians))
+        item.y = bot.y + (radius * math.sin(radians))
 
 
 @statement()
@@ -263,8 +295,19 @@ def increment_child_investment(bot):
     bot.child_investment += 1
 
 
+@batch_of(increment_child_investment)
+def _increment_child_investment_batch(store, rows, bots):
+    store.columns['child_investment'][rows] += 1
+
+
 @statement()
 def decrement_child_investment(bot):
     bot.child_investment -= 1
     if bot.child_investment <= 0:
         bot.child_investment = 1
+
+
+@batch_of(decrement_child_investment)
+def _decrement_child_investment_batch(store, rows, bots):
+    child_investment = store.columns['child_investment']
+    child_investment[rows] = np.maximum(child_investment[rows] - 1, 1)
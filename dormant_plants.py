@@ -0,0 +1,64 @@
+import numpy as np
+from sim_entities import Plant
+
+# wake_tick of a plant that is stepped every tick, and of a dormant plant that no roll will wake
+AWAKE = -1
+NEVER = np.iinfo(np.int64).max
+
+
+class DormantPlants:
+    # Plant phase that only steps plants whose state can change. A plant that cannot grow, because it is at
+    # max_energy or the energy pool is empty, goes dormant after its step. A dormant plant that is ready to reproduce
+    # draws the tick its next roll succeeds instead of rolling every tick. Dormant plants wake when that tick comes,
+    # when the pool has energy again (if it was what stopped them), or when one of their columns is changed, e.g. by
+    # a bot eating them. Aging and age-out deaths do not need plants to be stepped.
+    def __init__(self, world, store):
+        self.world = world
+        self.store = store
+        # Plants join the world awake. Finding the plants to wake is one comparison per plant, far cheaper than
+        # looking up the rows of scheduled ids.
+        store.add_column('wake_tick', np.int64, AWAKE)
+        store.add_column('starved', np.bool_, False)
+
+    def wake(self, plant):
+        self.store.columns['wake_tick'][plant._row] = AWAKE
+        self.store.columns['starved'][plant._row] = False
+
+    def awake_rows(self, count):
+        # Rows of the first count plants to step this tick
+        columns = self.store.columns
+        due = columns['wake_tick'][:count] <= self.world.tick_number
+        if self.world.energy_pool is None or self.world.energy_pool > 0:
+            due |= columns['starved'][:count]
+        return np.flatnonzero(due)
+
+    def step(self, count):
+        columns = self.store.columns
+        rows = self.awake_rows(count)
+        # Plants woken by their roll coming due had it drawn when they went dormant. Starved plants woken by the pool
+        # may still have a roll to come.
+        wake_tick = columns['wake_tick'][rows]
+        drawn = (wake_tick >= 0) & (wake_tick <= self.world.tick_number)
+        columns['wake_tick'][rows] = AWAKE
+        columns['starved'][rows] = False
+        Plant.step_plants(self.world, self.store, rows, drawn=drawn)
+        self.sleep(rows)
+
+    def sleep(self, rows):
+        # Put the plants in rows that cannot grow next tick to sleep
+        world, columns = self.world, self.store.columns
+        energy = columns['energy'][rows]
+        max_energy = columns['max_energy'][rows]
+        saturated = (energy >= max_energy) | (columns['growth_rate'][rows] <= 0)
+        starved = ~saturated & (world.energy_pool is not None and world.energy_pool <= 0)
+        sleeping = ~columns['dead'][rows] & (saturated | starved)
+        if not sleeping.any():
+            return
+        columns['starved'][rows[sleeping]] = starved[sleeping]
+        # Each step rolls with the same chance, so the number of steps to the first success is geometric
+        interval = world.plant_interval
+        chance = Plant.reproduction_chance(columns['percent_reproduction_chance'][rows], interval)
+        rolling = sleeping & (energy >= max_energy - columns['child_investment'][rows]) & (chance > 0)
+        wake_tick = np.full(len(rows), NEVER, dtype=np.int64)
+        wake_tick[rolling] = world.tick_number + interval * world.rng.geometric(chance[rolling])
+        columns['wake_tick'][rows[sleeping]] = wake_tick[sleeping]
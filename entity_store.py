@@ -0,0 +1,217 @@
+import numpy as np
+
+
+class Column:
+    # Descriptor exposing an entity attribute as a cell of its world's EntityStore. Entities that are not in a
+    # world yet (or have died and been removed) keep their values in a private dict instead.
+    def __init__(self, dtype, default=0, on_change=None):
+        self.dtype = np.dtype(dtype)
+        self.default = default
+        # Name of an entity method to call after the value of an entity in a world is changed
+        self.on_change = on_change
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, entity, owner=None):
+        if entity is None:
+            return self
+        store = entity._store
+        if store is None:
+            return entity._detached.get(self.name, self.default)
+        return store.columns[self.name].item(entity._row)
+
+    def __set__(self, entity, value):
+        store = entity._store
+        if store is None:
+            entity._detached[self.name] = value
+        else:
+            store.columns[self.name][entity._row] = value
+            if self.on_change is not None:
+                getattr(entity, self.on_change)()
+
+
+class Age:
+    # Descriptor for an entity's age. Ages are not stored: each row keeps the store clock reading at which the entity
+    # would have been age 0, so aging a whole store is a single increment of EntityStore.clock.
+    def __init__(self, on_change=None):
+        self.on_change = on_change
+
+    def __get__(self, entity, owner=None):
+        if entity is None:
+            return self
+        store = entity._store
+        if store is None:
+            return entity._detached.get('age', 0)
+        return store.clock - store.columns['age_origin'].item(entity._row)
+
+    def __set__(self, entity, value):
+        store = entity._store
+        if store is None:
+            entity._detached['age'] = value
+        else:
+            store.columns['age_origin'][entity._row] = store.clock - value
+            if self.on_change is not None:
+                getattr(entity, self.on_change)()
+
+
+class EntityStore:
+    # Columnar storage for every entity of one kind (plants, bots or signals). Row i of each column belongs to
+    # entities[i], so whole-population bookkeeping can be done with array operations.
+    def __init__(self, kind, capacity=64):
+        self.kind = kind
+        self.fields = EntityStore.find_columns(kind)
+        self.capacity = capacity
+        self.count = 0
+        self.entities = []
+        self.rows = {}
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.columns = {}
+        for name, column in self.fields.items():
+            self.columns[name] = np.zeros(capacity, dtype=column.dtype)
+        # Columns that belong to world machinery rather than to the entities, with the value new rows start with
+        self.internal_fills = {}
+        # Kinds with an Age get an age_origin column. clock counts the ticks the store has aged its entities by.
+        self.aging = any(isinstance(value, Age) for cls in kind.__mro__ for value in vars(cls).values())
+        self.clock = 0
+        if self.aging:
+            self.columns['age_origin'] = np.zeros(capacity, dtype=np.int64)
+
+    @staticmethod
+    def find_columns(kind):
+        fields = {}
+        for cls in reversed(kind.__mro__):
+            for name, value in vars(cls).items():
+                if isinstance(value, Column):
+                    fields[name] = value
+        return fields
+
+    def add_column(self, name, dtype, fill):
+        self.columns[name] = np.full(self.capacity, fill, dtype=dtype)
+        self.internal_fills[name] = fill
+
+    def __len__(self):
+        return self.count
+
+    def _grow(self):
+        self.capacity *= 2
+        self.ids = np.resize(self.ids, self.capacity)
+        for name, array in self.columns.items():
+            self.columns[name] = np.resize(array, self.capacity)
+
+    def add(self, entity, entity_id):
+        if self.count == self.capacity:
+            self._grow()
+        row = self.count
+        for name, column in self.fields.items():
+            value = entity._detached.get(name, column.default)
+            self.columns[name][row] = 0 if value is None else value
+        for name, fill in self.internal_fills.items():
+            self.columns[name][row] = fill
+        if self.aging:
+            self.columns['age_origin'][row] = self.clock - entity._detached.get('age', 0)
+        self.ids[row] = entity_id
+        self.rows[entity_id] = row
+        self.entities.append(entity)
+        entity.entity_id = entity_id
+        entity._store = self
+        entity._row = row
+        entity._detached = None
+        self.count += 1
+        return row
+
+    def detached_values(self, entities):
+        # The values entities not yet in a world hold for each column, as arrays for add_many
+        values = {}
+        for name, column in self.fields.items():
+            cells = (entity._detached.get(name, column.default) for entity in entities)
+            values[name] = np.fromiter((0 if value is None else value for value in cells), dtype=column.dtype,
+                                       count=len(entities))
+        if self.aging:
+            values['age'] = np.fromiter((entity._detached.get('age', 0) for entity in entities), dtype=np.int64,
+                                        count=len(entities))
+        return values
+
+    def add_many(self, entities, first_id, values):
+        # Bulk add: entities get consecutive ids from first_id, and each column is filled from the array or scalar
+        # in values, or with the column default. The entities' own detached values are not read.
+        count = len(entities)
+        while self.count + count > self.capacity:
+            self._grow()
+        rows = slice(self.count, self.count + count)
+        for name, column in self.fields.items():
+            value = values.get(name, column.default)
+            self.columns[name][rows] = 0 if value is None else value
+        for name, fill in self.internal_fills.items():
+            self.columns[name][rows] = fill
+        if self.aging:
+            self.columns['age_origin'][rows] = self.clock - values.get('age', 0)
+        ids = np.arange(first_id, first_id + count, dtype=np.int64)
+        self.ids[rows] = ids
+        for row, entity, entity_id in zip(range(self.count, self.count + count), entities, ids.tolist()):
+            self.rows[entity_id] = row
+            entity.entity_id = entity_id
+            entity._store = self
+            entity._row = row
+            entity._detached = None
+        self.entities.extend(entities)
+        self.count += count
+        return rows
+
+    def _detach(self, entity):
+        # Copy the row back into the entity so it stays readable after leaving the world
+        row = entity._row
+        entity._detached = {name: self.columns[name].item(row) for name in self.fields}
+        if self.aging:
+            entity._detached['age'] = self.clock - self.columns['age_origin'].item(row)
+        entity._store = None
+        entity._row = None
+        del self.rows[entity.entity_id]
+
+    def pop(self):
+        entity = self.entities.pop()
+        self._detach(entity)
+        self.count -= 1
+        return entity
+
+    def remove(self, entity):
+        # Swap-remove: the last row is moved into the freed row, so removal is O(1) but rows are not kept in
+        # insertion order
+        row = entity._row
+        last = self.count - 1
+        self._detach(entity)
+        if row != last:
+            moved = self.entities[last]
+            for array in self.columns.values():
+                array[row] = array[last]
+            self.ids[row] = self.ids[last]
+            self.entities[row] = moved
+            moved._row = row
+            self.rows[moved.entity_id] = row
+        self.entities.pop()
+        self.count -= 1
+
+    def remove_dead(self):
+        # Remove rows from the back so the row swapped into each hole is always a live one
+        dead_rows = np.flatnonzero(self.columns['dead'][:self.count])
+        removed = []
+        for row in dead_rows[::-1].tolist():
+            entity = self.entities[row]
+            self.remove(entity)
+            removed.append(entity)
+        return removed
+
+    def advance_clock(self, count):
+        # Age the first count entities by one tick. Rows past count were added during this tick and keep their age.
+        self.clock += 1
+        self.columns['age_origin'][count:self.count] += 1
+
+    def ages(self):
+        return self.clock - self.columns['age_origin'][:self.count]
+
+    def column(self, name):
+        return self.columns[name][:self.count]
+
+    def positions(self):
+        return np.column_stack((self.columns['x'][:self.count], self.columns['y'][:self.count]))
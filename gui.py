@@ -70,6 +70,14 @@ class ViewPort(BasePanel):
                                         math.floor(signal_color[2] - (signal_color[2] * age_ratio)))
                     pygame.draw.ellipse(self.surface, signal_color,
                                         (left, top, diameter*self.zoom, diameter*self.zoom), 1)
+            for effect in self.world.effects:
+                if self.point_is_visible((effect.x, effect.y)):
+                    diameter = effect.radius * 2
+                    left = ((effect.x - effect.radius) - self.camera_x) * self.zoom
+                    top = ((effect.y - effect.radius) - self.camera_y) * self.zoom
+                    effect_color = effect.color if effect.color else (75, 75, 75)
+                    pygame.draw.ellipse(self.surface, effect_color,
+                                        (left, top, diameter*self.zoom, diameter*self.zoom), 1)
         for plant in self.world.plants:
             if self.point_is_visible((plant.x, plant.y)):
                 energy_ratio = plant.energy/plant.max_energy
@@ -1,6 +1,8 @@
 import copy
+import weakref
+import hashlib
 import functools
-from random import random, choice
+from collections import deque, Counter
 import numpy as np
 
 
@@ -14,6 +16,31 @@ class NodeRegister:
     eligible_seed_statements = []
     required_seed_statements = []
     required_seed_conditionals = []
+    # Every function a node can call gets an integer id, so compiled behaviors can refer to functions by number
+    functions = []
+    function_ids = {}
+
+    @staticmethod
+    def function_id(function):
+        # Compiled behaviors call the undecorated function, skipping the registry's wrapper
+        function = getattr(function, '__wrapped__', function)
+        function_id = NodeRegister.function_ids.get(function)
+        if function_id is None:
+            function_id = len(NodeRegister.functions)
+            NodeRegister.function_ids[function] = function_id
+            NodeRegister.functions.append(function)
+        return function_id
+
+    # Conditionals that only read state, so brains with a node budget may run several of them in one tick
+    pure_conditionals = set()
+
+    # Batch variants of registered functions by function id, for wavefront execution. A batch variant is given the
+    # bot store, the store rows of the bots and the bots themselves, and returns one result per bot for conditionals.
+    batch_functions = {}
+
+    @staticmethod
+    def register_batch(function, batch_function):
+        NodeRegister.batch_functions[NodeRegister.function_id(function)] = batch_function
 
 
 def statement(seed_eligible=True, seed_required=False):
@@ -31,13 +58,16 @@ def statement(seed_eligible=True, seed_required=False):
     return dummy_statement
 
 
-def conditional(seed_eligible=True, seed_required=False):
+def conditional(seed_eligible=True, seed_required=False, pure=False):
+    # pure marks conditionals with no side effects
     def dummy_conditional(function):
         @functools.wraps(function)
         def dec(*args, **kwargs):
             # print("Function: %s" % function.__name__)
             return function(*args, **kwargs)
         NodeRegister.registered_conditionals.append(dec)
+        if pure:
+            NodeRegister.pure_conditionals.add(function)
         if seed_eligible:
             NodeRegister.eligible_seed_conditions.append(function)
         if seed_required:
@@ -46,6 +76,14 @@ def conditional(seed_eligible=True, seed_required=False):
     return dummy_conditional
 
 
+def batch_of(function):
+    # Registers the decorated function as the batch variant of a statement or conditional, for wavefront execution
+    def register(batch_function):
+        NodeRegister.register_batch(function, batch_function)
+        return batch_function
+    return register
+
+
 class BaseBehaviorNode:
     count = 0
 
@@ -54,6 +92,10 @@ class BaseBehaviorNode:
         BaseBehaviorNode.count += 1
         self.node_number = BaseBehaviorNode.count
         self.node_type = None
+        # How many edges each node (by node_number) has into this one, kept up to date by the edge setters
+        self.incoming = Counter()
+        # Set while the node is in a genome's node list, which holds it strongly
+        self.owned = False
 
     def execute(self, bot):
         return self.function(bot)
@@ -64,13 +106,82 @@ class BaseBehaviorNode:
     def points_to(self, node):
         return False
 
+    def edges(self):
+        return ()
+
+    # Edges to nodes owned by a genome are weak references, since the genome keeps them alive, and incoming edges are
+    # node numbers. A genome's nodes so form no reference cycles and are freed by reference counting once the genome
+    # lets go of them. Edges to nodes no genome owns yet are strong, so a graph can be built up node by node.
+    # Names of the attributes holding this kind of node's edges
+    edge_names = ()
+
+    def _relink(self, old_node, new_node):
+        # Move one of this node's edges from old_node to new_node and return the reference to store
+        number = self.node_number
+        if old_node is not None and number in old_node.incoming:
+            old_node.incoming[number] -= 1
+            if not old_node.incoming[number]:
+                del old_node.incoming[number]
+        if new_node is None:
+            return None
+        new_node.incoming[number] += 1
+        return weakref.ref(new_node) if new_node.owned else new_node
+
+    @staticmethod
+    def _follow(edge):
+        if isinstance(edge, weakref.ref):
+            node = edge()
+            if node is None:
+                raise ReferenceError("Edge to a node that was freed with its genome")
+            return node
+        return edge
+
+    def weaken_edges(self):
+        # Make the edges to nodes owned by a genome weak
+        for name in self.edge_names:
+            edge = getattr(self, name)
+            if isinstance(edge, BaseBehaviorNode) and edge.owned:
+                setattr(self, name, weakref.ref(edge))
+
+    def strengthen_edges(self):
+        # Make every edge but those back to the node itself strong, for a node leaving its genome while a bot may
+        # still be sitting on it. Genomes only point at nodes they own, so strong edges between nodes that left
+        # genomes cannot form cycles.
+        for name in self.edge_names:
+            edge = self._follow(getattr(self, name))
+            if edge is not None and edge is not self:
+                setattr(self, name, edge)
+
+    def __deepcopy__(self, memo):
+        # deepcopy would share the weak references, so copy the nodes they point to instead
+        node = self.__class__.__new__(self.__class__)
+        memo[id(self)] = node
+        for name, value in self.__dict__.items():
+            if isinstance(value, weakref.ref):
+                target = value()
+                value = None if target is None else weakref.ref(copy.deepcopy(target, memo))
+            else:
+                value = copy.deepcopy(value, memo)
+            node.__dict__[name] = value
+        return node
+
 
 class StatementNode(BaseBehaviorNode):
+    edge_names = ('_next_node',)
+
     def __init__(self, function):
         super().__init__(function)
-        self.next_node = None
+        self._next_node = None
         self.node_type = NodeRegister.statement
 
+    @property
+    def next_node(self):
+        return self._follow(self._next_node)
+
+    @next_node.setter
+    def next_node(self, node):
+        self._next_node = self._relink(self.next_node, node)
+
     def assign_edge(self, next_node):
         self.next_node = next_node
 
@@ -81,6 +192,9 @@ class StatementNode(BaseBehaviorNode):
     def points_to(self, node):
         return self.next_node == node
 
+    def edges(self):
+        return (self.next_node,)
+
     def replace_edge(self, find_node, replace_with_node):
         if self.next_node == find_node:
             self.next_node = replace_with_node
@@ -94,12 +208,30 @@ class StatementNode(BaseBehaviorNode):
 
 
 class ConditionalNode(BaseBehaviorNode):
+    edge_names = ('_true_node', '_false_node')
+
     def __init__(self, function):
         super().__init__(function)
-        self.true_node = None
-        self.false_node = None
+        self._true_node = None
+        self._false_node = None
         self.node_type = NodeRegister.conditional
 
+    @property
+    def true_node(self):
+        return self._follow(self._true_node)
+
+    @true_node.setter
+    def true_node(self, node):
+        self._true_node = self._relink(self.true_node, node)
+
+    @property
+    def false_node(self):
+        return self._follow(self._false_node)
+
+    @false_node.setter
+    def false_node(self, node):
+        self._false_node = self._relink(self.false_node, node)
+
     def assign_edges(self, true_node, false_node):
         self.true_node = true_node
         self.false_node = false_node
@@ -115,6 +247,9 @@ class ConditionalNode(BaseBehaviorNode):
     def points_to(self, node):
         return self.true_node == node or self.false_node == node
 
+    def edges(self):
+        return self.true_node, self.false_node
+
     def replace_edge(self, find_node, replace_with_node):
         if self.true_node == find_node:
             self.true_node = replace_with_node
@@ -133,123 +268,597 @@ class ConditionalNode(BaseBehaviorNode):
         return str(self.node_number) + '_' + self.function.__name__ + ' ? ' + true_name + ' : ' + false_name
 
 
-class BehaviorGraph:
+def breadth_first(start_nodes, nodes=None):
+    # Appends the nodes reachable from start_nodes to nodes in breadth-first order, following edges in order
+    if nodes is None:
+        nodes = []
+    seen = set(nodes)
+    pending = deque(start_nodes)
+    while pending:
+        node = pending.popleft()
+        if node is None or node in seen:
+            continue
+        seen.add(node)
+        nodes.append(node)
+        pending.extend(node.edges())
+    return nodes
+
+
+class CompiledBehavior:
+    # Flat form of a BehaviorGraph. Node i calls function function_ids[i] and moves on to next_indexes[i], or for
+    # conditionals to true_indexes[i] or false_indexes[i]. Missing edges are -1. The ops list mirrors the arrays as
+    # (function, is conditional, true index, false index) tuples for the interpreter loop.
+    def __init__(self, genome, current_node=None):
+        # Nodes are numbered in canonical order, so structurally identical genomes compile to the same tables,
+        # followed by anything only reachable from the current node
+        self.nodes = breadth_first([current_node], genome.canonical_nodes())
+        self.indexes = {node: index for index, node in enumerate(self.nodes)}
+        size = len(self.nodes)
+        self.function_ids = np.empty(size, dtype=np.int64)
+        self.conditional = np.zeros(size, dtype=bool)
+        self.next_indexes = np.full(size, -1, dtype=np.int64)
+        self.true_indexes = np.full(size, -1, dtype=np.int64)
+        self.false_indexes = np.full(size, -1, dtype=np.int64)
+        self.pure = np.zeros(size, dtype=bool)
+        self.ops = []
+        for index, node in enumerate(self.nodes):
+            self.function_ids[index] = NodeRegister.function_id(node.function)
+            function = NodeRegister.functions[self.function_ids[index]]
+            if node.node_type == NodeRegister.statement:
+                self.next_indexes[index] = self.index_of(node.next_node)
+                self.ops.append((function, False, self.next_indexes.item(index), self.next_indexes.item(index)))
+            else:
+                self.conditional[index] = True
+                self.pure[index] = function in NodeRegister.pure_conditionals
+                self.true_indexes[index] = self.index_of(node.true_node)
+                self.false_indexes[index] = self.index_of(node.false_node)
+                self.ops.append((function, True, self.true_indexes.item(index), self.false_indexes.item(index)))
+        # Where each node leads after a true or false result, with statements leading to their next node either way
+        self.true_targets = np.where(self.conditional, self.true_indexes, self.next_indexes)
+        self.false_targets = np.where(self.conditional, self.false_indexes, self.next_indexes)
+
+    def index_of(self, node):
+        if node is None:
+            return -1
+        return self.indexes[node]
+
+    def node_at(self, index):
+        if index < 0:
+            return None
+        return self.nodes[index]
+
+    def step(self, bot, index):
+        if index < 0:
+            raise ValueError("Current node must be a function, not None. (Bot: %s)" % bot)
+        function, is_conditional, true_index, false_index = self.ops[index]
+        result = function(bot)
+        if not is_conditional:
+            return true_index
+        if result is None:
+            raise ValueError("Functions of conditional nodes must return True or False, not None.")
+        return true_index if result else false_index
+
+    def run(self, bot, index, budget):
+        # Step up to budget nodes, carrying on only past pure conditionals. Stops early rather than run a node a
+        # second time, so a cycle of pure conditionals cannot spin.
+        visited = set()
+        pure = self.pure
+        while budget > 0 and index not in visited:
+            visited.add(index)
+            was_pure = pure.item(index)
+            index = self.step(bot, index)
+            budget -= 1
+            if not was_pure or index < 0:
+                break
+        return index
+
+
+def step_wavefront(store, rows, bots, budget=1):
+    # Advance the behavior of every bot, calling each function once for all the bots currently on it. With a budget
+    # above one, bots that just ran a pure conditional go round again, as in CompiledBehavior.run.
+    visited = None
+    if budget > 1:
+        # Brains are compiled first so the guard starts from the node each bot is on, as in CompiledBehavior.run
+        for bot in bots:
+            bot.behavior.compile()
+        visited = [{bot.behavior.current_index} for bot in bots]
+    while bots:
+        ran_pure = _wavefront_pass(store, rows, bots)
+        budget -= 1
+        if budget <= 0 or not ran_pure.any():
+            break
+        keep = []
+        for position in np.flatnonzero(ran_pure).tolist():
+            index = bots[position].behavior.current_index
+            if index >= 0 and index not in visited[position]:
+                visited[position].add(index)
+                keep.append(position)
+        rows = rows[keep]
+        bots = [bots[position] for position in keep]
+        visited = [visited[position] for position in keep]
+
+
+def _wavefront_pass(store, rows, bots):
+    # Advance the behavior of every bot by one node and return which bots ran a pure conditional. The compiled
+    # tables of the bots are concatenated so edges can be followed for every bot at once.
+    if not bots:
+        return np.zeros(0, dtype=bool)
+    table_offsets = {}
+    tables = []
+    offsets = np.empty(len(bots), dtype=np.int64)
+    current = np.empty(len(bots), dtype=np.int64)
+    size = 0
+    for position, bot in enumerate(bots):
+        behavior = bot.behavior
+        compiled = behavior.compile()
+        if behavior.current_index < 0:
+            raise ValueError("Current node must be a function, not None. (Bot: %s)" % bot)
+        offset = table_offsets.get(compiled)
+        if offset is None:
+            offset = table_offsets[compiled] = size
+            tables.append(compiled)
+            size += len(compiled.nodes)
+        offsets[position] = offset
+        current[position] = behavior.current_index
+    nodes = offsets + current
+    function_ids = np.concatenate([compiled.function_ids for compiled in tables])[nodes]
+    conditional = np.concatenate([compiled.conditional for compiled in tables])[nodes]
+    results = np.zeros(len(bots), dtype=bool)
+    stepped = np.zeros(len(bots), dtype=bool)
+    order = np.argsort(function_ids, kind='stable')
+    for group in np.split(order, np.flatnonzero(np.diff(function_ids[order])) + 1):
+        # Bots killed by an earlier group this tick do not act. The column is looked up again each time, since a
+        # group that adds bots can grow the store and replace it.
+        group = group[~store.columns['dead'][rows[group]]]
+        if not len(group):
+            continue
+        stepped[group] = True
+        function_id = function_ids.item(group[0])
+        group_bots = [bots[position] for position in group.tolist()]
+        batch_function = NodeRegister.batch_functions.get(function_id)
+        if batch_function is not None:
+            group_results = batch_function(store, rows[group], group_bots)
+        else:
+            function = NodeRegister.functions[function_id]
+            group_results = [function(bot) for bot in group_bots]
+        if conditional[group].any():
+            conditional_results = [result for result, is_conditional in zip(group_results, conditional[group])
+                                   if is_conditional]
+            if any(result is None for result in conditional_results):
+                raise ValueError("Functions of conditional nodes must return True or False, not None.")
+            results[group] = [bool(result) for result in group_results]
+    true_targets = np.concatenate([compiled.true_targets for compiled in tables])[nodes]
+    false_targets = np.concatenate([compiled.false_targets for compiled in tables])[nodes]
+    next_indexes = np.where(results, true_targets, false_targets)
+    for bot, index, moved in zip(bots, next_indexes.tolist(), stepped.tolist()):
+        if moved:
+            bot.behavior.current_index = index
+    return np.concatenate([compiled.pure for compiled in tables])[nodes] & stepped
+
+
+class Genome:
+    # The structure of a behavior: its nodes, entry node and compiled form. Genomes are shared between the
+    # BehaviorGraphs of related bots until one of them mutates.
+    def __init__(self, behavior_nodes=None, entry_node=None):
+        self.behavior_nodes = [] if behavior_nodes is None else behavior_nodes
+        self.entry_node = entry_node
+        self.compiled = None
+        self.shared = False
+        # Set while the genome is held by a GenomeTable
+        self.key = None
+        self.refcount = 0
+
+    @property
+    def behavior_nodes(self):
+        return self._behavior_nodes
+
+    @behavior_nodes.setter
+    def behavior_nodes(self, nodes):
+        self._behavior_nodes = nodes
+        self._slots = {node.node_number: slot for slot, node in enumerate(nodes)}
+        self._own(nodes)
+
+    @staticmethod
+    def _own(nodes):
+        for node in nodes:
+            node.owned = True
+        for node in nodes:
+            node.weaken_edges()
+
+    def node_slots(self):
+        # Position of each node in behavior_nodes by node number. Rebuilt, taking ownership of the nodes, if the list
+        # was appended to directly.
+        if len(self._slots) != len(self._behavior_nodes):
+            self._slots = {node.node_number: slot for slot, node in enumerate(self._behavior_nodes)}
+            self._own(self._behavior_nodes)
+        return self._slots
+
+    def add_node(self, node):
+        slots = self.node_slots()
+        slots[node.node_number] = len(self._behavior_nodes)
+        self._behavior_nodes.append(node)
+        self._own([node])
+
+    def remove_node(self, node):
+        # Swap-remove: the last node takes over the removed node's slot
+        slots = self.node_slots()
+        slot = slots.pop(node.node_number)
+        last = self._behavior_nodes.pop()
+        if last is not node:
+            self._behavior_nodes[slot] = last
+            slots[last.node_number] = slot
+        self._forget_edges(node)
+        # A bot may still be sitting on the removed node, so it keeps its successors alive
+        node.strengthen_edges()
+
+    @staticmethod
+    def _forget_edges(node):
+        # A node leaving the genome keeps its edges but stops counting as incoming
+        node.owned = False
+        for edge in node.edges():
+            if edge is not None:
+                edge.incoming.pop(node.node_number, None)
+
+    def keep_nodes(self, kept):
+        # Drop every node not in kept, preserving the order of the rest. No bot can reach the dropped nodes, so they
+        # keep their weak edges and are freed with each other.
+        for node in self._behavior_nodes:
+            if node not in kept:
+                self._forget_edges(node)
+        self.behavior_nodes = [node for node in self._behavior_nodes if node in kept]
+
+    def canonical_nodes(self):
+        # The nodes numbered by a breadth-first walk from the entry node, which ignores node_numbers and the order of
+        # behavior_nodes, followed by any nodes the entry node cannot reach in node list order
+        return breadth_first(self.behavior_nodes, breadth_first([self.entry_node]))
+
+    def canonical_key(self, nodes=None):
+        # Equal for genomes with the same topology and functions. Whether each node is in behavior_nodes is part of
+        # the key, since mutation only picks from that list.
+        if nodes is None:
+            nodes = self.canonical_nodes()
+        indexes = {node: index for index, node in enumerate(nodes)}
+        listed = self.node_slots()
+        return tuple((NodeRegister.function_id(node.function), node.node_type, node.node_number in listed,
+                      tuple(-1 if edge is None else indexes[edge] for edge in node.edges())) for node in nodes)
+
+    def canonical_hash(self):
+        # A hex digest of the canonical structure that names functions rather than numbering them, so it is stable
+        # between runs
+        text = []
+        nodes = self.canonical_nodes()
+        for (function_id, node_type, listed, edges) in self.canonical_key(nodes):
+            function = NodeRegister.functions[function_id]
+            text.append('%s.%s:%d:%d:%s' % (function.__module__, function.__qualname__, node_type, listed,
+                                            ','.join(str(edge) for edge in edges)))
+        return hashlib.sha1(';'.join(text).encode()).hexdigest()
+
+
+class GenomeTable:
+    # Interns genomes by canonical key, so bots with structurally identical brains share one Genome, and counts
+    # the bots holding each one
     def __init__(self):
-        self.behavior_nodes = []
-        self.entry_node = None
-        self.current_behavior_node = None
+        self.genomes = {}
+
+    def __len__(self):
+        return len(self.genomes)
+
+    def intern(self, behavior):
+        genome = behavior.genome
+        if genome.key is not None and self.genomes.get(genome.key) is genome:
+            genome.refcount += 1
+            return genome
+        nodes = genome.canonical_nodes()
+        key = genome.canonical_key(nodes)
+        interned = self.genomes.get(key)
+        if interned is None:
+            genome.key = key
+            genome.shared = True
+            genome.refcount = 1
+            self.genomes[key] = genome
+            return genome
+        current_node = behavior.current_behavior_node
+        # A bot sitting on a node outside its genome keeps the genome, but is still counted
+        if current_node is None or current_node in nodes:
+            behavior.adopt(interned, nodes.index(current_node) if current_node is not None else -1)
+        interned.refcount += 1
+        return interned
+
+    def release(self, genome):
+        genome.refcount -= 1
+        if genome.refcount <= 0:
+            del self.genomes[genome.key]
+            genome.key = None
+
+
+class MutationEngine:
+    # Source of randomness for generating and mutating behavior graphs. Uniform numbers are drawn from a numpy
+    # Generator a block at a time, so a seeded engine reproduces the same graphs and mutations.
+    def __init__(self, seed=None, block_size=4096):
+        if block_size < 1:
+            raise ValueError("Block size must be at least 1, not %s" % block_size)
+        # seed can be anything np.random.default_rng accepts, including a Generator to draw from
+        self.generator = np.random.default_rng(seed)
+        self.block_size = block_size
+        self._block = []
+        self._position = 0
+
+    def random(self):
+        if self._position == len(self._block):
+            self._block = self.generator.random(self.block_size).tolist()
+            self._position = 0
+        value = self._block[self._position]
+        self._position += 1
+        return value
+
+    def below(self, n):
+        return min(int(self.random() * n), n - 1)
+
+    def choice(self, sequence):
+        return sequence[self.below(len(sequence))]
+
+    def mutate(self, graph):
+        graph.mutate_behavior(self)
+
+    def mutate_batch(self, graphs):
+        # The mutation types for the whole batch are drawn in one go
+        mutation_types = self.generator.integers(0, BehaviorGraph.mutation_types, size=len(graphs))
+        for graph, mutation_type in zip(graphs, mutation_types.tolist()):
+            graph.mutate_behavior(self, mutation_type)
 
-    def step(self, bot):
-        if self.current_behavior_node is None:
-            raise ValueError("Current node must be a function, not None. (Bot: %s)" % bot)
-        self.current_behavior_node = self.current_behavior_node.execute(bot)
+
+class BehaviorGraph:
+    # A bot's behavior: a possibly shared Genome plus the bot's own position in it. Copies share the genome, and a
+    # graph takes a private copy of a shared genome just before it changes (copy-on-write).
+    # Bots step a CompiledBehavior built from the genome's nodes on first use. The nodes stay the editable form for
+    # mutation and graphing: the mutation methods drop the compiled form, and code that edits nodes directly after
+    # the graph has been stepped must call invalidate().
+    # Replace a function, shuffle an edge, inject a node or remove a node
+    mutation_types = 4
+
+    def __init__(self):
+        self.genome = Genome()
+        self._current_node = None
+        self.compiled = None
+        self.current_index = None
+
+    @property
+    def behavior_nodes(self):
+        return self.genome.behavior_nodes
+
+    @behavior_nodes.setter
+    def behavior_nodes(self, nodes):
+        self._own_genome().behavior_nodes = nodes
+
+    @property
+    def entry_node(self):
+        return self.genome.entry_node
+
+    @entry_node.setter
+    def entry_node(self, node):
+        if node is not self.genome.entry_node:
+            # A node of a shared genome is swapped for its counterpart in the private copy
+            copied = {}
+            genome = self._own_genome(copied)
+            genome.entry_node = copied.get(id(node), node)
+
+    @property
+    def current_behavior_node(self):
+        if self.compiled is not None:
+            return self.compiled.node_at(self.current_index)
+        return self._current_node
+
+    @current_behavior_node.setter
+    def current_behavior_node(self, node):
+        self._current_node = node
+        if self.compiled is not None and (node is None or node in self.compiled.indexes):
+            self.current_index = self.compiled.index_of(node)
+        else:
+            self.compiled = None
+            self.current_index = None
+
+    def _own_genome(self, copied=None):
+        # copied is filled in with the deepcopy memo, mapping id(node) to the node's copy
+        genome = self.genome
+        if genome.shared:
+            current_node = self.current_behavior_node
+            behavior_nodes, entry_node, current_node = copy.deepcopy((genome.behavior_nodes, genome.entry_node,
+                                                                      current_node), copied)
+            self.genome = Genome(behavior_nodes, entry_node)
+            self._current_node = current_node
+            self.compiled = None
+            self.current_index = None
+        return self.genome
+
+    def compile(self):
+        # Returns the compiled genome, compiling it if needed and finding this graph's position in it
+        genome = self.genome
+        if self.compiled is not None and self.compiled is genome.compiled:
+            return self.compiled
+        current_node = self.current_behavior_node
+        if genome.compiled is None or (current_node is not None and current_node not in genome.compiled.indexes):
+            genome.compiled = CompiledBehavior(genome, current_node)
+        self._current_node = current_node
+        self.compiled = genome.compiled
+        self.current_index = self.compiled.index_of(current_node)
+        return self.compiled
+
+    def invalidate(self):
+        self._current_node = self.current_behavior_node
+        self.compiled = None
+        self.current_index = None
+        self.genome.compiled = None
+
+    def _prepare_mutation(self):
+        self._own_genome()
+        self.invalidate()
+
+    def step(self, bot, budget=1):
+        # budget is the most nodes to run this step, see CompiledBehavior.run
+        compiled = self.compiled
+        if compiled is None or compiled is not self.genome.compiled:
+            compiled = self.compile()
+        if budget > 1:
+            self.current_index = compiled.run(bot, self.current_index, budget)
+        else:
+            self.current_index = compiled.step(bot, self.current_index)
 
     def set_entry_node(self, entry_node):
         self.entry_node = entry_node
-        self.current_behavior_node = entry_node
+        self.current_behavior_node = self.entry_node
+
+    def prune_unreachable(self):
+        # Drop the nodes that neither the entry node nor the current node can reach, returning how many went
+        if self.entry_node is None and self.current_behavior_node is None:
+            return 0
+        reachable = set(breadth_first([self.entry_node, self.current_behavior_node]))
+        if all(node in reachable for node in self.behavior_nodes):
+            return 0
+        if self.genome.shared:
+            self._own_genome()
+            reachable = set(breadth_first([self.entry_node, self.current_behavior_node]))
+        self.invalidate()
+        size = len(self.behavior_nodes)
+        self.genome.keep_nodes(reachable)
+        return size - len(self.behavior_nodes)
+
+    def adopt(self, genome, canonical_index):
+        # Switch to a structurally identical genome, keeping this graph's position by canonical index
+        compiled = genome.compiled
+        if compiled is None:
+            compiled = genome.compiled = CompiledBehavior(genome)
+        self.genome = genome
+        self.compiled = compiled
+        self.current_index = canonical_index
+        self._current_node = compiled.node_at(canonical_index)
 
     def return_tree_copy(self):
-        return copy.deepcopy(self)
-
-    def generate_random_graph(self, number_of_nodes, percent_conditional=0.5):
+        # The copy shares this graph's genome rather than copying its nodes
+        self.genome.shared = True
+        behavior = BehaviorGraph()
+        behavior.genome = self.genome
+        behavior._current_node = self.current_behavior_node
+        behavior.compiled = self.compiled
+        behavior.current_index = self.current_index
+        return behavior
+
+    def generate_random_graph(self, number_of_nodes, percent_conditional=0.5, rng=None):
+        if rng is None:
+            rng = default_mutation_engine
+        self.genome = Genome()
+        self.invalidate()
         # First pick some random functions from the registry and create nodes from them
         self.behavior_nodes = []
         required_node_count = len(NodeRegister.required_seed_statements) + len(NodeRegister.required_seed_conditionals)
         for n in range(required_node_count):
             # Set a temporary node in case the following fails
-            node = StatementNode(choice(NodeRegister.eligible_seed_statements))
+            node = StatementNode(rng.choice(NodeRegister.eligible_seed_statements))
             if NodeRegister.required_seed_conditionals and NodeRegister.required_seed_statements:
-                if random() < percent_conditional:
-                    node = ConditionalNode(choice(NodeRegister.required_seed_conditionals))
+                if rng.random() < percent_conditional:
+                    node = ConditionalNode(rng.choice(NodeRegister.required_seed_conditionals))
                 else:
-                    node = StatementNode(choice(NodeRegister.required_seed_statements))
+                    node = StatementNode(rng.choice(NodeRegister.required_seed_statements))
             elif NodeRegister.required_seed_conditionals:
-                node = ConditionalNode(choice(NodeRegister.required_seed_conditionals))
+                node = ConditionalNode(rng.choice(NodeRegister.required_seed_conditionals))
             elif NodeRegister.required_seed_statements:
-                node = StatementNode(choice(NodeRegister.required_seed_statements))
+                node = StatementNode(rng.choice(NodeRegister.required_seed_statements))
             number_of_nodes -= 1
-            self.behavior_nodes.append(node)
+            self.genome.add_node(node)
         if number_of_nodes > 0:
             for counter in range(0, number_of_nodes):
-                if random() < percent_conditional:
-                    node = ConditionalNode(choice(NodeRegister.eligible_seed_conditions))
+                if rng.random() < percent_conditional:
+                    node = ConditionalNode(rng.choice(NodeRegister.eligible_seed_conditions))
                 else:
-                    node = StatementNode(choice(NodeRegister.eligible_seed_statements))
-                self.behavior_nodes.append(node)
+                    node = StatementNode(rng.choice(NodeRegister.eligible_seed_statements))
+                self.genome.add_node(node)
         # Now hook the nodes together randomly
         for node in self.behavior_nodes:
             if node.node_type == NodeRegister.statement:
-                node.next_node = choice(self.behavior_nodes)
+                node.next_node = rng.choice(self.behavior_nodes)
             else:
-                node.true_node = choice(self.behavior_nodes)
-                node.false_node = choice(self.behavior_nodes)
+                node.true_node = rng.choice(self.behavior_nodes)
+                node.false_node = rng.choice(self.behavior_nodes)
         # Now pic a random entry node
-        self.set_entry_node(choice(self.behavior_nodes))
-
-    def mutate_behavior(self):
-        mutation_type = np.random.random_integers(0, 3)
+        self.set_entry_node(rng.choice(self.behavior_nodes))
+
+    def mutate_behavior(self, rng=None, mutation_type=None):
+        if rng is None:
+            rng = default_mutation_engine
+        # Take a private genome first so the nodes chosen below belong to it
+        self._own_genome()
+        if mutation_type is None:
+            mutation_type = rng.below(BehaviorGraph.mutation_types)
         if mutation_type == 0:
-            self._mutate_replace_function()
+            self._mutate_replace_function(rng)
         elif mutation_type == 1:
-            self._mutate_shuffle_outgoing_edge()
+            self._mutate_shuffle_outgoing_edge(rng)
         elif mutation_type == 2:
-            self._mutate_inject_node()
+            self._mutate_inject_node(rng)
         else:
-            self._mutate_remove_node(choice(self.behavior_nodes))
+            self._mutate_remove_node(rng.choice(self.behavior_nodes), rng)
 
     def get_all_nodes_pointing_to(self, node, include_self=True):
-        connected = []
-        for n in self.behavior_nodes:
-            if n.points_to(node):
-                connected.append(n)
+        # Nodes removed from the graph may still point here, so only count the ones in it, in node list order
+        slots = self.genome.node_slots()
+        connected = [self.behavior_nodes[slot] for slot in sorted(slots[number] for number in node.incoming
+                                                                   if number in slots)]
         if not include_self:
             connected[:] = [x for x in connected if x != node]
         return connected
 
-    def _mutate_replace_function(self):
-        node = choice(self.behavior_nodes)
+    def _mutate_replace_function(self, rng=None):
+        if rng is None:
+            rng = default_mutation_engine
+        self._prepare_mutation()
+        node = rng.choice(self.behavior_nodes)
         if node.node_type == NodeRegister.statement:
-            random_function = choice(NodeRegister.registered_statements)
+            random_function = rng.choice(NodeRegister.registered_statements)
         elif node.node_type == NodeRegister.conditional:
-            random_function = choice(NodeRegister.registered_conditionals)
+            random_function = rng.choice(NodeRegister.registered_conditionals)
         else:
             raise ValueError("Node %s has been discovered as neither a statement or condition." % node)
         node.function = random_function
 
-    def _mutate_shuffle_outgoing_edge(self):
-        node = choice(self.behavior_nodes)
+    def _mutate_shuffle_outgoing_edge(self, rng=None):
+        if rng is None:
+            rng = default_mutation_engine
+        self._prepare_mutation()
+        node = rng.choice(self.behavior_nodes)
         if node.node_type == NodeRegister.statement:
-            node.next_node = choice(self.behavior_nodes)
+            node.next_node = rng.choice(self.behavior_nodes)
         elif node.node_type == NodeRegister.conditional:
             # Make a choice to decide which edge to modify
-            if random() < 0.5:
-                node.true_node = choice(self.behavior_nodes)
+            if rng.random() < 0.5:
+                node.true_node = rng.choice(self.behavior_nodes)
             else:
-                node.false_node = choice(self.behavior_nodes)
+                node.false_node = rng.choice(self.behavior_nodes)
         else:
             raise ValueError("Node %s has been discovered as neither a statement or condition." % node)
 
-    def _mutate_inject_node(self):
-        previous = choice(self.behavior_nodes)
+    def _mutate_inject_node(self, rng=None):
+        if rng is None:
+            rng = default_mutation_engine
+        self._prepare_mutation()
+        previous = rng.choice(self.behavior_nodes)
         # Make a choice to decide which type of node to inject
-        new_node_type = choice((NodeRegister.statement, NodeRegister.conditional))
+        new_node_type = rng.choice((NodeRegister.statement, NodeRegister.conditional))
         # Injecting a statement in front of a statement
         if previous.node_type == NodeRegister.statement and new_node_type == NodeRegister.statement:
-            new_node = StatementNode(choice(NodeRegister.registered_statements))
+            new_node = StatementNode(rng.choice(NodeRegister.registered_statements))
             new_node.assign_edge(previous.next_node)
             previous.next_node = new_node
         # Injecting a conditional in front of a statement
         elif previous.node_type == NodeRegister.statement and new_node_type == NodeRegister.conditional:
-            new_node = ConditionalNode(choice(NodeRegister.registered_conditionals))
-            if random() < 0.5:
-                new_node.assign_edges(previous.next_node, choice(self.behavior_nodes))
+            new_node = ConditionalNode(rng.choice(NodeRegister.registered_conditionals))
+            if rng.random() < 0.5:
+                new_node.assign_edges(previous.next_node, rng.choice(self.behavior_nodes))
             else:
-                new_node.assign_edges(choice(self.behavior_nodes), previous.next_node)
+                new_node.assign_edges(rng.choice(self.behavior_nodes), previous.next_node)
             previous.next_node = new_node
         # Injecting a statement in front of a conditional
         elif previous.node_type == NodeRegister.conditional and new_node_type == NodeRegister.statement:
-            new_node = StatementNode(choice(NodeRegister.registered_statements))
-            if random() < 0.5:
+            new_node = StatementNode(rng.choice(NodeRegister.registered_statements))
+            if rng.random() < 0.5:
                 new_node.assign_edge(previous.true_node)
                 previous.true_node = new_node
             else:
@@ -257,28 +866,31 @@ class BehaviorGraph:
                 previous.false_node = new_node
         # Injecting a conditional in front of a conditional
         elif previous.node_type == NodeRegister.conditional and new_node_type == NodeRegister.conditional:
-            new_node = ConditionalNode(choice(NodeRegister.registered_conditionals))
-            if random() < 0.5:
-                if random() < 0.5:
-                    new_node.assign_edges(previous.true_node, choice(self.behavior_nodes))
+            new_node = ConditionalNode(rng.choice(NodeRegister.registered_conditionals))
+            if rng.random() < 0.5:
+                if rng.random() < 0.5:
+                    new_node.assign_edges(previous.true_node, rng.choice(self.behavior_nodes))
                 else:
-                    new_node.assign_edges(choice(self.behavior_nodes), previous.true_node)
+                    new_node.assign_edges(rng.choice(self.behavior_nodes), previous.true_node)
                 previous.true_node = new_node
             else:
-                if random() < 0.5:
-                    new_node.assign_edges(previous.false_node, choice(self.behavior_nodes))
+                if rng.random() < 0.5:
+                    new_node.assign_edges(previous.false_node, rng.choice(self.behavior_nodes))
                 else:
-                    new_node.assign_edges(choice(self.behavior_nodes), previous.false_node)
+                    new_node.assign_edges(rng.choice(self.behavior_nodes), previous.false_node)
                 previous.false_node = new_node
         else:
             raise ValueError("Node %s has been detected as neither a statement or condition." % previous)
-        self.behavior_nodes.append(new_node)
+        self.genome.add_node(new_node)
 
-    def _mutate_remove_node(self, node_to_remove):
+    def _mutate_remove_node(self, node_to_remove, rng=None):
+        if rng is None:
+            rng = default_mutation_engine
+        self._prepare_mutation()
         # Do not remove the node if it is the only one in the graph, just return False
         if len(self.behavior_nodes) == 1:
             return False
-        self.behavior_nodes.remove(node_to_remove)
+        self.genome.remove_node(node_to_remove)
         incoming_nodes = self.get_all_nodes_pointing_to(node_to_remove, include_self=False)
         # Case of removing a statement node
         if node_to_remove.node_type == NodeRegister.statement:
@@ -290,7 +902,7 @@ class BehaviorGraph:
                     incoming.replace_edge(find_node=node_to_remove, replace_with_node=destination_node)
             else:
                 if node_to_remove is self.entry_node:
-                    self.set_entry_node(choice(self.behavior_nodes))
+                    self.set_entry_node(rng.choice(self.behavior_nodes))
                 for incoming in incoming_nodes:
                     incoming.replace_edge(find_node=node_to_remove, replace_with_node=incoming)
         # Case of removing a conditional node
@@ -299,14 +911,15 @@ class BehaviorGraph:
             false_node = node_to_remove.false_node
             if true_node is node_to_remove and false_node is node_to_remove:
                 if node_to_remove is self.entry_node:
-                    self.set_entry_node(choice(self.behavior_nodes))
+                    self.set_entry_node(rng.choice(self.behavior_nodes))
                 for incoming in incoming_nodes:
                     incoming.replace_edge(find_node=node_to_remove, replace_with_node=incoming)
             elif true_node is not node_to_remove and false_node is not node_to_remove:
                 if node_to_remove is self.entry_node:
-                    self.set_entry_node(choice([true_node, false_node]))
+                    self.set_entry_node(rng.choice([true_node, false_node]))
                 for incoming in incoming_nodes:
-                    incoming.replace_edge(find_node=node_to_remove, replace_with_node=choice([false_node, true_node]))
+                    incoming.replace_edge(find_node=node_to_remove,
+                                          replace_with_node=rng.choice([false_node, true_node]))
             else:
                 next_node = true_node if true_node is not node_to_remove else false_node
                 if node_to_remove is self.entry_node:
@@ -314,3 +927,7 @@ class BehaviorGraph:
                 for incoming in incoming_nodes:
                     incoming.replace_edge(find_node=node_to_remove, replace_with_node=next_node)
         return True
+
+
+# Used by graphs generated or mutated without an engine of their own
+default_mutation_engine = MutationEngine()
@@ -1,11 +1,31 @@
 import math
+import weakref
 from intelligence import *
+from entity_store import Column, Age
 from numpy.random import ranf
 import numpy as np
 
 
 class BaseSimulationEntity:
+    # These attributes live in the world's EntityStore once the entity has been added to a world
+    x = Column(np.float64)
+    y = Column(np.float64)
+    energy = Column(np.float64)
+    age = Age(on_change='schedule_death')
+    max_age = Column(np.int64, on_change='schedule_death')
+    dead = Column(np.bool_, False)
+    birthday = Column(np.int64, None)
+    # Entities of immobile kinds never change position once placed, so spatial indexes may keep them between ticks
+    mobile = True
+    # An entity is marked dead by the aging that takes it to max_age + death_age_offset. The offsets keep the tick
+    # each kind has always died on.
+    death_age_offset = 0
+
     def __init__(self, x, y):
+        self._store = None
+        self._row = None
+        self._detached = {}
+        self.entity_id = None
         self.name = 'entity'
         self.world = None
         self.x = x
@@ -16,11 +36,23 @@ class BaseSimulationEntity:
         self.age = 0
         self.number_children = 0
 
+    @property
+    def registered(self):
+        # True while the entity has a row in a world's store
+        return self._store is not None
+
+    def schedule_death(self):
+        if self._store is not None:
+            self.world.schedule_deaths(self._store, [self._row])
+
     def step(self):
-        self.age += 1
-        self.world.drain_energy_from_entity(1, self)
-        if self.energy < 1:
-            self.dead = True
+        # Per-entity behavior only. Aging, energy drain and death checks are done for the whole population at
+        # once by step_population.
+        pass
+
+    @staticmethod
+    def step_population(world, store, count):
+        pass
 
     def __str__(self):
         return self.name
@@ -28,12 +60,21 @@ class BaseSimulationEntity:
 
 class Bot(BaseSimulationEntity):
     counter = 0
+    peak_energy = Column(np.float64)
+    speed = Column(np.float64)
+    child_investment = Column(np.int64)
+    signal_direction = Column(np.float64)
+    # A target point of None is stored as NaN coordinates
+    target_x = Column(np.float64, np.nan)
+    target_y = Column(np.float64, np.nan)
 
     def __init__(self, x_start, y_start, generation_number=-1, behavior_graph=None, name=None):
         super().__init__(x_start, y_start)
         # TODO: Create some kind of individual-level memory
         # TODO: Create bot fields that can control signal movement, size, and investment
         self.behavior = behavior_graph
+        # The genome this bot is counted under in its world's GenomeTable
+        self.interned_genome = None
         self.speed = 1
         self.child_investment = 600
         self.max_age = 5000
@@ -49,24 +90,64 @@ class Bot(BaseSimulationEntity):
         else:
             self.name = name
 
+    @property
+    def target_point(self):
+        target_x = self.target_x
+        if math.isnan(target_x):
+            return None
+        return target_x, self.target_y
+
+    @target_point.setter
+    def target_point(self, point):
+        if point is None:
+            self.target_x, self.target_y = np.nan, np.nan
+        else:
+            self.target_x, self.target_y = point
+
     def step(self):
+        self.before_behavior()
+        self.behavior.step(self, self.world.brain_budget)
+        self.after_behavior()
+
+    def before_behavior(self):
         if self.behavior is None:
             raise ValueError("Behavior Tree for %s must be BehaviorGraph object, not None." % self)
         if self.signal and self.signal.dead:
             self.signal = None
-        self.behavior.step(self)
+
+    def after_behavior(self):
         # Check if the bot has created a new signal
-        if self.signal and self.signal not in self.world.signals:
+        if self.signal and not self.signal.registered:
             self.world.add_entity(self.signal)
-        super().step()
-        if self.age >= self.max_age:
-            self.dead = True
-        if self.energy > self.peak_energy:
-            self.peak_energy = self.energy
+
+    @staticmethod
+    def step_population(world, store, count):
+        world.drain_energy_from_store(1, store, count)
+        world.age_store(store, count)
+        energy = store.column('energy')[:count]
+        store.column('dead')[:count] |= energy < 1
+        peak_energy = store.column('peak_energy')[:count]
+        np.maximum(peak_energy, energy, out=peak_energy)
 
 
 class Plant(BaseSimulationEntity):
     counter = 0
+    mobile = False
+    # Plants were checked against max_age before aging, so they die at max_age + 2
+    death_age_offset = 2
+    # Kept as columns so the whole plant population can grow and reproduce with array operations. Changing the
+    # ones that decide whether a plant grows or reproduces wakes it if it is dormant.
+    energy = Column(np.float64, on_change='wake')
+    max_energy = Column(np.float64, on_change='wake')
+    growth_rate = Column(np.float64, on_change='wake')
+    child_investment = Column(np.float64, on_change='wake')
+    spore_min_travel = Column(np.int64)
+    spore_max_travel = Column(np.int64)
+    percent_reproduction_chance = Column(np.int64, on_change='wake')
+    number_children = Column(np.int64)
+    # Copied from parent to child when plants reproduce in bulk
+    inherited_columns = ('max_age', 'max_energy', 'growth_rate', 'child_investment', 'spore_min_travel',
+                         'spore_max_travel', 'percent_reproduction_chance')
 
     def __init__(self, x, y, name=None):
         super().__init__(x, y)
@@ -84,15 +165,75 @@ class Plant(BaseSimulationEntity):
         self.spore_max_travel = 80
         self.percent_reproduction_chance = 5
 
+    def wake(self):
+        if self.world.dormant_plants is not None:
+            self.world.dormant_plants.wake(self)
+
     def step(self):
         # Check if the plant can grow
         if self.energy < self.max_energy:
             self.world.give_energy_to_entity(self.growth_rate, self)
         self.check_reproduction()
-        # Check for death
-        if self.age > self.max_age:
-            self.dead = True
-        self.age += 1
+
+    @staticmethod
+    def step_plants(world, store, rows, drawn=None):
+        # Plant.step for the plants in rows (ascending) at once: growth from the energy pool, then reproduction.
+        # Plants flagged in drawn had their reproduction roll drawn in advance and it succeeded.
+        columns = store.columns
+        alive = ~columns['dead'][rows]
+        energy = columns['energy'][rows]
+        max_energy = columns['max_energy'][rows]
+        # Growth tops plants up to max_energy. With a finite pool, plants are served in row order until it runs dry,
+        # as when each plant takes its share in turn.
+        # Plants stepped every plant_interval ticks grow for all of them at once
+        interval = world.plant_interval
+        wanted = np.clip(max_energy - energy, 0, columns['growth_rate'][rows] * interval) * alive
+        if world.energy_pool is not None:
+            wanted = np.clip(world.energy_pool - (np.cumsum(wanted) - wanted), 0, wanted)
+            world.energy_pool -= wanted.sum().item()
+        energy += wanted
+        columns['energy'][rows] = energy
+        ready = alive & (energy >= max_energy - columns['child_investment'][rows])
+        if not ready.any():
+            return
+        rolling = ready if drawn is None else ready & ~drawn
+        succeeded = np.zeros(len(rows), dtype=np.bool_) if drawn is None else ready & drawn
+        percent = columns['percent_reproduction_chance'][rows[rolling]]
+        if interval == 1:
+            # random_integers(0, 100) in the per-plant roll draws from 101 values
+            succeeded[rolling] = world.rng.integers(0, 101, size=len(percent)) < percent
+        else:
+            succeeded[rolling] = world.rng.random(len(percent)) < Plant.reproduction_chance(percent, interval)
+        parents = rows[succeeded]
+        if world.plant_limit:
+            parents = parents[:max(world.plant_limit - len(store), 0)]
+        if not len(parents):
+            return
+        distance = world.rng.integers(columns['spore_min_travel'][parents], columns['spore_max_travel'][parents],
+                                      endpoint=True)
+        angle = world.rng.random(len(parents)) * 2 * math.pi
+        energy = columns['energy'][parents]
+        investment = np.minimum(columns['child_investment'][parents], energy)
+        columns['dead'][parents] |= energy <= columns['child_investment'][parents]
+        columns['energy'][parents] = energy - investment
+        columns['number_children'][parents] += 1
+        values = {name: columns[name][parents] for name in Plant.inherited_columns}
+        values['x'] = columns['x'][parents] + distance * np.sin(angle)
+        values['y'] = columns['y'][parents] + distance * np.cos(angle)
+        values['energy'] = investment
+        world._insert(store, [Plant(0, 0) for _ in range(len(parents))], values)
+
+    @staticmethod
+    def reproduction_chance(percent, ticks=1):
+        # Chance that at least one of ticks per-tick rolls succeeds. A roll succeeds for 0 <= roll < percent out of
+        # 101 values.
+        chance = np.clip(percent / 101, 0, 1)
+        return chance if ticks == 1 else 1 - (1 - chance) ** ticks
+
+    @staticmethod
+    def step_population(world, store, count):
+        for _ in range(world.plant_interval):
+            world.age_store(store, count)
 
     def check_reproduction(self):
         if self.energy >= (self.max_energy - self.child_investment):
@@ -112,14 +253,22 @@ class Plant(BaseSimulationEntity):
 
 class Signal(BaseSimulationEntity):
     counter = 0
+    death_age_offset = 1
+    diameter = Column(np.float64)
 
     def __init__(self, x, y, owner, name=None, color=None, max_age=1):
         super().__init__(x, y)
         self.message_signal_type = owner.message_signal_type
-        self.owner = owner
+        # The owner keeps a reference to its signal, so the signal only keeps a weak one back
+        self._owner = weakref.ref(owner)
         self.origination_pos = owner.x, owner.y
         self.world = owner.world
-        self.detected_objects = []
+        self._detected_indexes = np.empty(0, dtype=np.intp)
+        self._detected_from = None
+        self._detected_objects = []
+        self._detected_tick = None
+        self._kind_detections = {}
+        self._kind_detection_tick = None
         self.diameter = 8
         self.speed = 0
         self.color = color
@@ -130,20 +279,73 @@ class Signal(BaseSimulationEntity):
         else:
             self.name = 'Signal_' + str(Signal.counter)
 
-    def step(self):
-        self.detected_objects = []
-        if self.world.kd_tree:
-            # Note: KDTree lookup always returns the signal object as the closest point
-            indexes = self.world.kd_tree.query_ball_point((np.array((self.x, self.y))), r=self.diameter//2)
-            for index in indexes:
-                entity = self.world.all_entities[index]
-                if entity not in self.detected_objects:
-                    self.detected_objects.append(entity)
-        self.age += 1
-        if self.energy < 1:
-            self.dead = True
-        if self.age > self.max_age:
-            self.dead = True
+    @property
+    def owner(self):
+        return self._owner()
+
+    def clear_detection(self):
+        # Dead signals let go of the entity lists they detected from, which include the signal itself
+        self._detected_from = None
+        self._detected_objects = []
+        self._detected_tick = None
+        self._kind_detections = {}
+        self._kind_detection_tick = None
+
+    def detect(self):
+        # Note: the signal itself is among the detected entities once it has been indexed
+        indexes = self.world.spatial_index.query_radius(self.x, self.y, self.diameter//2)
+        self.set_detected(indexes, self.world.all_entities)
+
+    def set_detected(self, indexes, all_entities, tick=None):
+        # Keep the tick's all_entities list the indexes point into, since the world rebuilds it every tick. tick is
+        # the index tick the detection is read under, by default the current one.
+        self._detected_indexes = indexes
+        self._detected_from = all_entities
+        self._detected_objects = None
+        self._detected_tick = self.world.index_tick if tick is None else tick
+
+    def _refresh_detection(self):
+        # Detection is computed the first time it is asked for and reused until the spatial index is rebuilt
+        if self.world is not None and self._detected_tick != self.world.index_tick:
+            self.detect()
+
+    @property
+    def detected_indexes(self):
+        self._refresh_detection()
+        return self._detected_indexes
+
+    @property
+    def detected_objects(self):
+        self._refresh_detection()
+        if self._detected_objects is None:
+            self._detected_objects = [self._detected_from[index] for index in self._detected_indexes]
+        return self._detected_objects
+
+    def detected_of(self, kinds):
+        # Detected entities of the given kinds, queried from only those kinds' indexes unless a full detection has
+        # already been done this tick
+        world = self.world
+        if world is None:
+            return []
+        if self._detected_tick == world.index_tick:
+            return [entity for entity in self.detected_objects if isinstance(entity, kinds)]
+        if self._kind_detection_tick != world.index_tick:
+            self._kind_detections = {}
+            self._kind_detection_tick = world.index_tick
+        found = self._kind_detections.get(kinds)
+        if found is None:
+            query_kinds = kinds if isinstance(kinds, tuple) else (kinds,)
+            found = world.query_radius(self.x, self.y, self.diameter//2, kinds=query_kinds)
+            self._kind_detections[kinds] = found
+        return found
+
+    @staticmethod
+    def step_population(world, store, count):
+        # In batched mode detection for every living signal is resolved in one query after all signals have moved
+        if world.signal_detection == 'batched':
+            world.detect_signals(store, count)
+        world.age_store(store, count)
+        store.column('dead')[:count] |= store.column('energy')[:count] < 1
 
     def __str__(self):
         return self.name
@@ -156,9 +358,6 @@ class StaticSignal(Signal):
         self.speed = 0
         self.diameter = 4
 
-    def step(self):
-        super().step()
-
 
 class MobileSignal(Signal):
     def __init__(self, x, y, radians, owner, name=None, color=None, max_age=10):
@@ -170,5 +369,4 @@ class MobileSignal(Signal):
 
     def step(self):
         self.x += self.x_diff
-        self.y += self.y_diff
-        super().step()
\ No newline at end of file
+        self.y += self.y_diff
\ No newline at end of file
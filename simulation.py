@@ -66,7 +66,7 @@ class Simulation:
         # Set an environment variable to center the pygame screen
         # TODO: Move display stuff into the View
         self.world = world
-        self.data_collector = WorldWatcher(self.world)
+        self.data_collector = WorldWatcher(self.world, time_gc=True)
         # os.environ['SDL_VIDEO_CENTERED'] = '1'
         pygame.init()
         self.clock = pygame.time.Clock()
@@ -134,9 +134,9 @@ class Simulation:
                     self.world.selected_bot = None
                     # Get the mouse position relative to the view port
                     world_point = self.view_port.surface_point_to_world((point_x, point_y))
-                    distances, indexes = self.world.kd_tree.query(world_point, k=15)
-                    for distance, index in zip(distances, indexes):
-                        entity = self.world.all_entities[index]
+                    # Only bots among the entities nearest the click can be selected, so clicking empty space
+                    # selects nothing
+                    for distance, entity in self.world.query_nearest(world_point[0], world_point[1], 15):
                         if isinstance(entity, Bot):
                             self.world.selected_bot = entity
                             print('Selecting bot near world point', world_point)
@@ -415,7 +415,7 @@ class Simulation:
 # TODO: Allow selecting from multiple behavior files
 if __name__ == '__main__':
     print("Starting Simulation...")
-    earth = World(boundary_sizes=(380, 210), energy_pool=200000)
+    earth = World(boundary_sizes=(380, 210), energy_pool=200000, record_effects=True, prune_brains=True)
     basic_brain = create_basic_brain()
     minimal_brain = create_very_simple_brain()
     print("Controls:")
@@ -0,0 +1,329 @@
+import math
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+# Spatial index backends for World. Each backend is refreshed once per tick by update(), after dead entities have
+# been removed and world.all_entities rebuilt, and answers queries with positions into world.all_entities.
+# In worlds with boundary_sizes the backends treat space as a torus, so queries see across the seams.
+# Entities are indexed separately per store (plants, bots, signals), so a query can be limited to some kinds
+# without wading through the others.
+
+
+class SpatialIndex:
+    def __init__(self, world):
+        self.world = world
+        self.boundary_sizes = world.boundary_sizes
+        self.offsets = {}
+        self.counts = {}
+
+    def update(self):
+        # Stores are laid out in all_entities one after the other, in the world's store order
+        offset = 0
+        for store in self.world.stores:
+            self.offsets[store] = offset
+            self.counts[store] = len(store)
+            offset += len(store)
+            self.update_store(store)
+
+    def update_store(self, store):
+        raise NotImplementedError
+
+    def remove(self, store, rows):
+        pass
+
+    def _wrap(self, x, y):
+        if self.boundary_sizes:
+            return x % self.boundary_sizes[0], y % self.boundary_sizes[1]
+        return x, y
+
+    def _indexed_stores(self, stores):
+        if stores is None:
+            stores = self.world.stores
+        return [store for store in stores if self.counts.get(store)]
+
+    def query_radius(self, x, y, radius, stores=None):
+        x, y = self._wrap(x, y)
+        results = [self.offsets[store] + self.query_store_radius(store, x, y, radius)
+                   for store in self._indexed_stores(stores)]
+        if not results:
+            return np.empty(0, dtype=np.intp)
+        return np.concatenate(results)
+
+    def query_radius_batch(self, points, radii, stores=None):
+        if self.boundary_sizes:
+            points = points % self.boundary_sizes
+        per_store = [[self.offsets[store] + rows for rows in self.query_store_radius_batch(store, points, radii)]
+                     for store in self._indexed_stores(stores)]
+        if not per_store:
+            return [np.empty(0, dtype=np.intp) for _ in range(len(points))]
+        return [np.concatenate(results) for results in zip(*per_store)]
+
+    def query_nearest(self, x, y, k, stores=None):
+        x, y = self._wrap(x, y)
+        distances, indexes = [np.empty(0)], [np.empty(0, dtype=np.intp)]
+        for store in self._indexed_stores(stores):
+            store_distances, rows = self.query_store_nearest(store, x, y, k)
+            distances.append(store_distances)
+            indexes.append(self.offsets[store] + rows)
+        distances, indexes = np.concatenate(distances), np.concatenate(indexes)
+        nearest = np.argsort(distances, kind='stable')[:k]
+        return distances[nearest], indexes[nearest]
+
+    def query_store_radius_batch(self, store, points, radii):
+        return [self.query_store_radius(store, x, y, radius) for (x, y), radius in zip(points.tolist(), radii.tolist())]
+
+
+class StaticTree:
+    # A cKDTree over entities that never move, kept across ticks. Entities added since the tree was built wait in
+    # a small buffer that is searched by brute force, and removed entities are masked out of the tree.
+    def __init__(self, store, boxsize):
+        points = store.positions()
+        self.tree = cKDTree(points, leafsize=15, boxsize=boxsize)
+        self.box = None if boxsize is None else np.array(boxsize, dtype=np.float64)
+        self.size = len(points)
+        self.removed = np.zeros(self.size, dtype=bool)
+        self.removed_count = 0
+        self.rows_moved = False
+        # Current store row of each tree point
+        self.point_rows = np.arange(self.size)
+        store.column('tree_point')[:] = self.point_rows
+        self.buffer_rows = np.empty(0, dtype=np.intp)
+        self.buffer_points = np.empty((0, 2))
+
+    def pending(self, newborn_count):
+        return newborn_count + self.removed_count
+
+    def remove(self, store, rows):
+        tree_points = store.column('tree_point')
+        points = tree_points[rows]
+        points = points[points >= 0]
+        self.removed[points] = True
+        self.removed_count += len(points)
+        self.rows_moved = True
+
+    def update(self, store, newborn_rows):
+        if self.rows_moved:
+            # Removals swap rows around, so refresh where each surviving tree point lives now
+            tree_points = store.column('tree_point')
+            indexed = np.flatnonzero(tree_points >= 0)
+            self.point_rows[tree_points[indexed]] = indexed
+            self.rows_moved = False
+        self.buffer_rows = newborn_rows
+        self.buffer_points = store.positions()[newborn_rows]
+
+    def _tree_rows(self, points):
+        points = np.asarray(points, dtype=np.intp)
+        return self.point_rows[points[~self.removed[points]]]
+
+    def _buffer_offsets(self, points):
+        offsets = self.buffer_points[np.newaxis, :, :] - np.asarray(points, dtype=np.float64)[:, np.newaxis, :]
+        if self.box is not None:
+            offsets -= self.box * np.round(offsets / self.box)
+        return offsets
+
+    def query_radius(self, x, y, radius):
+        return self.query_radius_batch(np.array([(x, y)]), np.array([radius]), workers=1)[0]
+
+    def query_radius_batch(self, points, radii, workers):
+        results = self.tree.query_ball_point(points, r=radii, workers=workers, return_sorted=False)
+        if len(self.buffer_rows):
+            offsets = self._buffer_offsets(points)
+            inside = np.einsum('pbi,pbi->pb', offsets, offsets) <= (np.asarray(radii) ** 2)[:, np.newaxis]
+            return [np.concatenate((self._tree_rows(tree_points), self.buffer_rows[near]))
+                    for tree_points, near in zip(results, inside)]
+        return [self._tree_rows(tree_points) for tree_points in results]
+
+    def query_nearest(self, x, y, k):
+        # Ask the tree for extra neighbours to make up for any that have been removed
+        distances, points = self.tree.query((x, y), k=min(k + self.removed_count, max(self.size, 1)))
+        distances, points = np.atleast_1d(distances), np.atleast_1d(points)
+        found = np.isfinite(distances)
+        distances, points = distances[found], points[found]
+        alive = ~self.removed[points]
+        distances, rows = distances[alive], self.point_rows[points[alive]]
+        if len(self.buffer_rows):
+            buffer_distances = np.hypot(*self._buffer_offsets([(x, y)])[0].T)
+            distances = np.concatenate((distances, buffer_distances))
+            rows = np.concatenate((rows, self.buffer_rows))
+        nearest = np.argsort(distances, kind='stable')[:k]
+        return distances[nearest], rows[nearest]
+
+
+class KDTreeIndex(SpatialIndex):
+    # Rebuilds a cKDTree per store each tick. Stores of immobile entities (plants) keep a StaticTree instead, which
+    # is only rebuilt once births and deaths since the last build exceed rebuild_fraction of its size. Batched
+    # queries are spread over the given number of worker threads (-1 uses every core).
+    def __init__(self, world, workers=-1, rebuild_fraction=0.25):
+        super().__init__(world)
+        self.workers = workers
+        self.rebuild_fraction = rebuild_fraction
+        self.trees = {}
+        self.static_trees = {}
+        for store in world.stores:
+            if not store.kind.mobile:
+                store.add_column('tree_point', np.int64, -1)
+                self.static_trees[store] = None
+
+    def update_store(self, store):
+        if store in self.static_trees:
+            self.update_static_store(store)
+        elif len(store) > 0:
+            self.trees[store] = cKDTree(store.positions(), leafsize=15, boxsize=self.boundary_sizes)
+        else:
+            self.trees.pop(store, None)
+
+    def update_static_store(self, store):
+        static_tree = self.static_trees[store]
+        newborn_rows = np.flatnonzero(store.column('tree_point') < 0)
+        if static_tree is None or static_tree.pending(len(newborn_rows)) > self.rebuild_fraction * static_tree.size:
+            self.static_trees[store] = StaticTree(store, self.boundary_sizes)
+        else:
+            static_tree.update(store, newborn_rows)
+
+    def remove(self, store, rows):
+        static_tree = self.static_trees.get(store)
+        if static_tree is not None:
+            static_tree.remove(store, rows)
+
+    def query_store_radius(self, store, x, y, radius):
+        if store in self.static_trees:
+            return self.static_trees[store].query_radius(x, y, radius)
+        return np.array(self.trees[store].query_ball_point((x, y), r=radius), dtype=np.intp)
+
+    def query_store_radius_batch(self, store, points, radii):
+        if store in self.static_trees:
+            return self.static_trees[store].query_radius_batch(points, radii, self.workers)
+        results = self.trees[store].query_ball_point(points, r=radii, workers=self.workers, return_sorted=False)
+        return [np.array(rows, dtype=np.intp) for rows in results]
+
+    def query_store_nearest(self, store, x, y, k):
+        if store in self.static_trees:
+            return self.static_trees[store].query_nearest(x, y, k)
+        distances, rows = self.trees[store].query((x, y), k=k)
+        distances, rows = np.atleast_1d(distances), np.atleast_1d(rows)
+        # cKDTree pads the result with infinite distances when there are fewer than k points
+        found = np.isfinite(distances)
+        return distances[found], rows[found]
+
+
+class GridIndex(SpatialIndex):
+    # Buckets entities into square cells. Each tick only the entities whose cell changed (because they moved, were
+    # born or died) are moved between buckets, so maintenance costs O(moved) rather than a full rebuild.
+    unindexed = np.iinfo(np.int64).min
+
+    def __init__(self, world, cell_size=16):
+        super().__init__(world)
+        if self.boundary_sizes:
+            # Stretch the cells so a whole number of them spans each boundary, then wrap cell coordinates
+            self.cells_across = tuple(max(1, int(size // cell_size)) for size in self.boundary_sizes)
+            self.cell_sizes = tuple(size / cells for size, cells in zip(self.boundary_sizes, self.cells_across))
+            self.box = np.array(self.boundary_sizes, dtype=np.float64)
+        else:
+            self.cells_across = None
+            self.cell_sizes = cell_size, cell_size
+        self.buckets = {}
+        self.points = {}
+        for store in world.stores:
+            store.add_column('grid_cell', np.int64, GridIndex.unindexed)
+            self.buckets[store] = {}
+
+    @staticmethod
+    def cell_key(cell_x, cell_y):
+        # Pack the two cell coordinates into one integer so whole columns can be compared at once
+        return (cell_x + 2**30) * 2**31 + (cell_y + 2**30)
+
+    def _cells_of(self, x, y):
+        cell_x = np.floor_divide(x, self.cell_sizes[0]).astype(np.int64)
+        cell_y = np.floor_divide(y, self.cell_sizes[1]).astype(np.int64)
+        if self.cells_across:
+            cell_x %= self.cells_across[0]
+            cell_y %= self.cells_across[1]
+        return self.cell_key(cell_x, cell_y)
+
+    def _cell_range(self, low, high, axis):
+        first = math.floor(low / self.cell_sizes[axis])
+        last = math.floor(high / self.cell_sizes[axis])
+        if not self.cells_across:
+            return range(first, last + 1)
+        cells_across = self.cells_across[axis]
+        if last - first + 1 >= cells_across:
+            return range(cells_across)
+        return [cell % cells_across for cell in range(first, last + 1)]
+
+    def update_store(self, store):
+        buckets = self.buckets[store]
+        indexed_cells = store.column('grid_cell')
+        if store.kind.mobile:
+            cells = self._cells_of(store.column('x'), store.column('y'))
+            changed = np.flatnonzero(cells != indexed_cells)
+            cells = cells[changed]
+            self.points[store] = store.positions()
+        else:
+            # Immobile entities only need bucketing once, when they first appear
+            changed = np.flatnonzero(indexed_cells == GridIndex.unindexed)
+            cells = self._cells_of(store.column('x')[changed], store.column('y')[changed])
+        for row, new_cell in zip(changed.tolist(), cells.tolist()):
+            entity = store.entities[row]
+            old_cell = indexed_cells[row]
+            if old_cell != GridIndex.unindexed:
+                self._discard(buckets, old_cell, entity)
+            buckets.setdefault(new_cell, set()).add(entity)
+            indexed_cells[row] = new_cell
+
+    def _positions(self, store, rows=slice(None)):
+        # Mobile stores are read from this tick's snapshot; immobile ones straight from the store
+        if store in self.points:
+            return self.points[store][rows]
+        return np.column_stack((store.columns['x'][:store.count][rows], store.columns['y'][:store.count][rows]))
+
+    @staticmethod
+    def _discard(buckets, cell, entity):
+        bucket = buckets[cell]
+        bucket.discard(entity)
+        if not bucket:
+            del buckets[cell]
+
+    def remove(self, store, rows):
+        buckets = self.buckets[store]
+        indexed_cells = store.column('grid_cell')
+        for row in rows:
+            cell = indexed_cells[row]
+            if cell != GridIndex.unindexed:
+                self._discard(buckets, cell, store.entities[row])
+                indexed_cells[row] = GridIndex.unindexed
+
+    def _offsets_to(self, store, rows, x, y):
+        offset_points = self._positions(store, rows) - (x, y)
+        if self.boundary_sizes:
+            # Use the shortest offset around the torus
+            offset_points -= self.box * np.round(offset_points / self.box)
+        return offset_points
+
+    def query_store_radius(self, store, x, y, radius):
+        buckets = self.buckets[store]
+        candidates = []
+        for cell_x in self._cell_range(x - radius, x + radius, 0):
+            for cell_y in self._cell_range(y - radius, y + radius, 1):
+                bucket = buckets.get(self.cell_key(cell_x, cell_y))
+                if bucket:
+                    candidates.extend(bucket)
+        if not candidates:
+            return np.empty(0, dtype=np.intp)
+        rows = np.fromiter((entity._row for entity in candidates), dtype=np.intp, count=len(candidates))
+        offset_points = self._offsets_to(store, rows, x, y)
+        inside = np.einsum('ij,ij->i', offset_points, offset_points) <= radius * radius
+        return rows[inside]
+
+    def query_store_nearest(self, store, x, y, k):
+        # Grow the search radius until it holds k entities or covers every indexed point
+        span = np.abs(self._positions(store) - (x, y)).max()
+        radius = min(self.cell_sizes)
+        while True:
+            rows = self.query_store_radius(store, x, y, radius)
+            if len(rows) >= k or radius > 2 * span:
+                break
+            radius *= 2
+        distances = np.hypot(*self._offsets_to(store, rows, x, y).T)
+        nearest = np.argsort(distances)[:k]
+        return distances[nearest], rows[nearest]
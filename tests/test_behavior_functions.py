@@ -0,0 +1,67 @@
+import unittest
+import numpy as np
+import behavior_functions
+from simulation import World
+from sim_entities import Bot
+from intelligence import NodeRegister
+
+
+def bot_world(seed, boundary_sizes=None):
+    random_state = np.random.RandomState(seed)
+    world = World(boundary_sizes=boundary_sizes)
+    for x, y, target_x, target_y, direction in random_state.uniform(0, 100, size=(40, 5)):
+        bot = Bot(x, y)
+        bot.target_point = (target_x, target_y) if target_x > 10 else None
+        bot.signal_direction = 0 if direction < 10 else direction
+        bot.child_investment = int(direction) - 20
+        world.add_entity(bot)
+        world.give_energy_to_entity(random_state.uniform(0, 200), bot)
+    # Put a few bots right next to their targets
+    for bot in world.bots[:5]:
+        bot.target_point = bot.x + 1, bot.y - 1
+    return world
+
+
+class TestBatchVariantsMatchBotFunctions(unittest.TestCase):
+    columns = ('x', 'y', 'target_x', 'target_y', 'signal_direction', 'child_investment')
+
+    def check_batch_variant(self, function, boundary_sizes=None):
+        per_bot, batched = bot_world(4, boundary_sizes), bot_world(4, boundary_sizes)
+        np.random.seed(9)
+        expected = [function(bot) for bot in per_bot.bots]
+        np.random.seed(9)
+        rows = np.arange(len(batched.bots))
+        batch_function = NodeRegister.batch_functions[NodeRegister.function_id(function)]
+        found = batch_function(batched.bot_store, rows, batched.bots)
+        if found is not None:
+            self.assertEqual([bool(result) for result in expected], list(found),
+                             "%s batch results should match" % function.__name__)
+        for name in self.columns:
+            np.testing.assert_allclose(batched.bot_store.column(name), per_bot.bot_store.column(name),
+                                       err_msg="%s batch should update %s like per-bot calls" %
+                                               (function.__name__, name))
+
+    def test_batch_variants(self):
+        for function in (behavior_functions.wait, behavior_functions.reproduce_possible,
+                         behavior_functions.very_low_energy, behavior_functions.move_towards_target,
+                         behavior_functions.target_nearby, behavior_functions.set_random_target,
+                         behavior_functions.set_random_signal_direction,
+                         behavior_functions.move_towards_signal_direction,
+                         behavior_functions.increment_child_investment, behavior_functions.decrement_child_investment):
+            self.check_batch_variant(function)
+
+    def test_move_towards_target_across_boundary(self):
+        self.check_batch_variant(behavior_functions.move_towards_target, boundary_sizes=(60, 60))
+
+
+class TestBotTargetPoint(unittest.TestCase):
+    def test_target_point_round_trip(self):
+        bot = Bot(3, 4)
+        self.assertEqual(bot.target_point, (3, 4), "Bots should start targeting their starting point")
+        bot.target_point = None
+        self.assertIsNone(bot.target_point, "A cleared target should read back as None")
+        world = World()
+        world.add_entity(bot)
+        bot.target_point = 7, 8
+        self.assertEqual(bot.target_point, (7, 8), "Targets should be stored in the world's columns")
+        self.assertEqual(world.bot_store.column('target_x').tolist(), [7])
@@ -1,4 +1,9 @@
+import gc
+import copy
 import unittest
+import weakref
+import numpy as np
+import behavior_functions
 from intelligence import *
 
 
@@ -22,3 +27,355 @@ class TestBehaviorGraphNodeRemoval(unittest.TestCase):
         self.assertEqual(b, self.graph.current_behavior_node, "Removing an entry point statement node without incoming \
         edges that points to another statement node should set the second statement node as the current node")
 
+
+class TestCompiledBehavior(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.check = ConditionalNode(lambda bot: self.calls.append('check') or len(self.calls) % 3 == 1)
+        self.left = StatementNode(lambda bot: self.calls.append('left'))
+        self.right = StatementNode(lambda bot: self.calls.append('right'))
+        self.check.assign_edges(self.left, self.right)
+        self.left.assign_edge(self.check)
+        self.right.assign_edge(self.check)
+        self.graph = BehaviorGraph()
+        self.graph.behavior_nodes = [self.check, self.left, self.right]
+        self.graph.set_entry_node(self.check)
+
+    def test_compiled_steps_match_node_execution(self):
+        node = self.check
+        for _ in range(12):
+            node = node.execute(None)
+        expected_calls, self.calls[:] = list(self.calls), []
+        for _ in range(12):
+            self.graph.step(None)
+        self.assertEqual(self.calls, expected_calls, "Compiled stepping should follow the same path as the nodes")
+        self.assertIs(self.graph.current_behavior_node, node, "The current node should be tracked while compiled")
+
+    def test_compiled_tables(self):
+        compiled = self.graph.compile()
+        self.assertEqual(compiled.conditional.tolist(), [True, False, False])
+        self.assertEqual(compiled.true_indexes.tolist(), [1, -1, -1])
+        self.assertEqual(compiled.false_indexes.tolist(), [2, -1, -1])
+        self.assertEqual(compiled.next_indexes.tolist(), [-1, 0, 0])
+
+    def test_registered_functions_are_called_unwrapped(self):
+        @statement(seed_eligible=False)
+        def registered_wait(bot):
+            pass
+        NodeRegister.registered_statements.remove(registered_wait)
+        node = StatementNode(registered_wait)
+        node.assign_edge(node)
+        self.graph.behavior_nodes = [node]
+        self.graph.set_entry_node(node)
+        self.graph.invalidate()
+        compiled = self.graph.compile()
+        self.assertIs(compiled.ops[0][0], registered_wait.__wrapped__, "The decorator's wrapper should be skipped")
+
+    def test_mutation_recompiles(self):
+        self.graph.step(None)
+        compiled = self.graph.compiled
+        self.graph._mutate_remove_node(self.right)
+        self.assertIsNone(self.graph.compiled, "Mutating the graph should drop the compiled form")
+        self.assertIs(self.graph.current_behavior_node, self.left, "The current node should survive recompiling")
+        self.graph.step(None)
+        self.assertIsNot(self.graph.compiled, compiled, "Stepping after a mutation should recompile")
+        self.assertIs(self.graph.current_behavior_node, self.check)
+
+    def test_budget_stops_after_the_first_impure_node(self):
+        NodeRegister.pure_conditionals.add(self.check.function)
+        try:
+            self.graph.step(None, budget=5)
+            self.assertEqual(self.calls, ['check', 'left'], "A pure conditional should not end the step")
+            self.graph.step(None, budget=1)
+            self.assertEqual(self.calls, ['check', 'left', 'check'], "A budget of one should run a single node")
+        finally:
+            NodeRegister.pure_conditionals.discard(self.check.function)
+
+    def test_budget_ignores_impure_conditionals(self):
+        self.graph.step(None, budget=5)
+        self.assertEqual(self.calls, ['check'])
+
+    def test_budget_stops_pure_cycles(self):
+        ping, pong = ConditionalNode(lambda bot: self.calls.append('ping') or True), ConditionalNode(lambda bot: True)
+        ping.assign_edges(pong, pong)
+        pong.assign_edges(ping, ping)
+        NodeRegister.pure_conditionals.update((ping.function, pong.function))
+        try:
+            self.graph.behavior_nodes = [ping, pong]
+            self.graph.set_entry_node(ping)
+            self.graph.step(None, budget=100)
+        finally:
+            NodeRegister.pure_conditionals.difference_update((ping.function, pong.function))
+        self.assertEqual(self.calls, ['ping'], "Each node should run at most once per step")
+        self.assertIs(self.graph.current_behavior_node, ping)
+
+    def test_missing_edge_raises(self):
+        self.left.assign_edge(None)
+        self.graph.set_entry_node(self.left)
+        self.graph.step(None)
+        with self.assertRaises(ValueError):
+            self.graph.step(None)
+
+
+class TestSharedGenomes(unittest.TestCase):
+    def setUp(self):
+        self.first = StatementNode(lambda bot: None)
+        self.second = StatementNode(lambda bot: None)
+        self.first.assign_edge(self.second)
+        self.second.assign_edge(self.first)
+        self.parent = BehaviorGraph()
+        self.parent.behavior_nodes = [self.first, self.second]
+        self.parent.set_entry_node(self.first)
+
+    def test_copies_share_the_genome(self):
+        child = self.parent.return_tree_copy()
+        self.assertIs(child.genome, self.parent.genome, "Copies should share the parent's genome")
+        self.assertIs(child.behavior_nodes[0], self.first, "Copies should not duplicate nodes")
+        child.set_entry_node(self.first)
+        self.assertIs(child.genome, self.parent.genome, "Setting the same entry node should not copy the genome")
+
+    def test_execution_state_is_per_graph(self):
+        child = self.parent.return_tree_copy()
+        child.step(None)
+        self.assertIs(child.current_behavior_node, self.second, "The child should advance")
+        self.assertIs(self.parent.current_behavior_node, self.first, "The parent should stay where it was")
+        self.parent.step(None)
+        self.assertIs(self.parent.compiled, child.compiled, "Graphs sharing a genome should share its compiled form")
+
+    def test_mutation_copies_a_shared_genome(self):
+        child = self.parent.return_tree_copy()
+        child.step(None)
+        child._mutate_shuffle_outgoing_edge()
+        self.assertIsNot(child.genome, self.parent.genome, "Mutating should give the child its own genome")
+        self.assertEqual(self.parent.behavior_nodes, [self.first, self.second], "The parent's nodes should not change")
+        self.assertIs(self.first.next_node, self.second, "The parent's edges should not change")
+        self.assertNotIn(self.first, child.behavior_nodes, "The child should only hold copied nodes")
+        self.assertIn(child.current_behavior_node, child.behavior_nodes,
+                      "The child's position should move over to the copied nodes")
+
+    def test_new_entry_node_of_a_shared_genome_is_copied(self):
+        child = self.parent.return_tree_copy()
+        child.set_entry_node(self.second)
+        self.assertIsNot(child.genome, self.parent.genome, "A new entry node should give the child its own genome")
+        self.assertIs(child.entry_node, child.behavior_nodes[1], "The entry node should be the copied node")
+        self.assertIs(child.current_behavior_node, child.entry_node)
+        self.assertIs(self.parent.entry_node, self.first, "The parent's entry node should not change")
+
+    def test_clone_starting_at_its_first_node(self):
+        # create_clone starts every child at its first node, whatever the parent's entry node is
+        self.parent.set_entry_node(self.second)
+        clone = self.parent.return_tree_copy()
+        clone.set_entry_node(clone.behavior_nodes[0])
+        self.assertIs(clone.entry_node, clone.behavior_nodes[0], "The clone's entry node should be one of its nodes")
+        self.assertIsNot(clone.entry_node, self.first, "The clone should not point into the parent's nodes")
+        self.assertIs(clone.entry_node.next_node, clone.behavior_nodes[1])
+        clone.step(None)
+        self.assertIs(clone.current_behavior_node, clone.behavior_nodes[1])
+
+
+def first_function(bot):
+    return True
+
+
+def second_function(bot):
+    pass
+
+
+def two_node_graph(conditional_function=first_function, reverse_list=False):
+    check = ConditionalNode(conditional_function)
+    act = StatementNode(second_function)
+    check.assign_edges(act, check)
+    act.assign_edge(check)
+    graph = BehaviorGraph()
+    graph.behavior_nodes = [act, check] if reverse_list else [check, act]
+    graph.set_entry_node(check)
+    return graph
+
+
+class TestGenomeInterning(unittest.TestCase):
+    def test_canonical_key_ignores_node_numbers_and_list_order(self):
+        first, second = two_node_graph(), two_node_graph(reverse_list=True)
+        self.assertEqual(first.genome.canonical_key(), second.genome.canonical_key(),
+                         "Identically structured graphs should have the same key")
+        self.assertEqual(first.genome.canonical_hash(), second.genome.canonical_hash())
+
+    def test_canonical_key_depends_on_functions(self):
+        first, second = two_node_graph(), two_node_graph(conditional_function=lambda bot: True)
+        self.assertNotEqual(first.genome.canonical_key(), second.genome.canonical_key(),
+                            "Graphs calling different functions should have different keys")
+        self.assertNotEqual(first.genome.canonical_hash(), second.genome.canonical_hash())
+
+    def test_interning_shares_one_genome(self):
+        table = GenomeTable()
+        first, second = two_node_graph(), two_node_graph()
+        second.step(None)
+        position = second.current_index
+        self.assertIs(table.intern(first), first.genome)
+        self.assertIs(table.intern(second), first.genome, "An identical genome should be interned to the first")
+        self.assertIs(second.genome, first.genome, "The second graph should adopt the interned genome")
+        self.assertEqual(second.current_index, position, "Adopting should keep the graph's position")
+        self.assertEqual(len(table), 1)
+        self.assertEqual(first.genome.refcount, 2)
+        table.release(first.genome)
+        table.release(first.genome)
+        self.assertEqual(len(table), 0, "Genomes should leave the table when no bot holds them")
+
+
+class TestMutationEngine(unittest.TestCase):
+    @staticmethod
+    def evolve(seed, block_size=4096):
+        engine = MutationEngine(seed, block_size=block_size)
+        graphs = []
+        for _ in range(5):
+            graph = BehaviorGraph()
+            graph.generate_random_graph(8, rng=engine)
+            graphs.append(graph)
+        for _ in range(20):
+            engine.mutate_batch(graphs)
+        return [graph.genome.canonical_key() for graph in graphs]
+
+    def test_same_seed_gives_same_graphs(self):
+        self.assertEqual(self.evolve(4), self.evolve(4), "A seeded engine should reproduce its mutations")
+        self.assertNotEqual(self.evolve(4), self.evolve(5))
+
+    def test_block_size_only_changes_how_numbers_are_drawn(self):
+        engine, single = MutationEngine(6), MutationEngine(6, block_size=1)
+        self.assertEqual([engine.random() for _ in range(10)], [single.random() for _ in range(10)])
+
+    def test_choices_stay_in_range(self):
+        engine = MutationEngine(7, block_size=16)
+        self.assertEqual(sorted(set(engine.below(3) for _ in range(200))), [0, 1, 2])
+        with self.assertRaises(ValueError):
+            MutationEngine(block_size=0)
+
+
+class TestIncomingEdgeIndex(unittest.TestCase):
+    def assert_index_consistent(self, graph):
+        for node in graph.behavior_nodes:
+            expected = [n for n in graph.behavior_nodes if n.points_to(node)]
+            self.assertEqual(graph.get_all_nodes_pointing_to(node), expected,
+                             "Incoming edges should match a scan of the node list, in list order")
+        self.assertEqual(graph.genome.node_slots(),
+                         {node.node_number: slot for slot, node in enumerate(graph.behavior_nodes)})
+
+    def test_edge_setters_track_incoming_edges(self):
+        a, b = StatementNode(None), ConditionalNode(None)
+        a.next_node = b
+        b.assign_edges(a, a)
+        self.assertEqual(a.incoming, {b.node_number: 2}, "Both of a conditional's edges should be counted")
+        b.false_node = b
+        self.assertEqual(a.incoming, {b.node_number: 1})
+        self.assertEqual(b.incoming, {a.node_number: 1, b.node_number: 1})
+
+    def test_mutations_keep_index_consistent(self):
+        engine = MutationEngine(2)
+        graph = BehaviorGraph()
+        graph.generate_random_graph(12, rng=engine)
+        for _ in range(300):
+            graph.mutate_behavior(engine)
+            self.assert_index_consistent(graph)
+
+
+class TestAcyclicNodes(unittest.TestCase):
+    def test_dropped_graph_is_freed_without_the_cycle_collector(self):
+        graph = BehaviorGraph()
+        graph.generate_random_graph(10, rng=MutationEngine(3))
+        graph.compile()
+        nodes = [weakref.ref(node) for node in graph.behavior_nodes]
+        gc.disable()
+        try:
+            del graph
+            self.assertTrue(all(node() is None for node in nodes), "Nodes should be freed by reference counting")
+        finally:
+            gc.enable()
+
+    def test_deepcopy_copies_edge_targets(self):
+        a, b = StatementNode(first_function), ConditionalNode(second_function)
+        a.assign_edge(b)
+        b.assign_edges(a, b)
+        a_copy, b_copy = copy.deepcopy([a, b])
+        self.assertIs(a_copy.next_node, b_copy)
+        self.assertIs(b_copy.true_node, a_copy)
+        self.assertIs(b_copy.false_node, b_copy)
+        self.assertIs(a.next_node, b, "The original edges should be untouched")
+
+    def test_edges_keep_nodes_outside_a_genome_alive(self):
+        a = StatementNode(first_function)
+        a.assign_edge(StatementNode(second_function))
+        self.assertIs(a.next_node.function, second_function, "Nodes built by hand should keep their successors")
+        graph = BehaviorGraph()
+        graph.behavior_nodes = [a, a.next_node]
+        self.assertIsInstance(a._next_node, weakref.ref, "Edges between a genome's nodes should be weak")
+
+    def test_edges_into_a_freed_genome_fail_loudly(self):
+        a, b = StatementNode(first_function), StatementNode(second_function)
+        a.assign_edge(b)
+        graph = BehaviorGraph()
+        graph.behavior_nodes = [a, b]
+        del graph, b
+        with self.assertRaises(ReferenceError):
+            a.next_node
+
+    def test_removed_nodes_keep_their_successors(self):
+        a, b, c = (StatementNode(second_function) for _ in range(3))
+        a.assign_edge(b)
+        b.assign_edge(c)
+        c.assign_edge(a)
+        graph = BehaviorGraph()
+        graph.behavior_nodes = [a, b, c]
+        graph.set_entry_node(a)
+        graph.step(None)
+        graph._mutate_remove_node(b)
+        graph._mutate_remove_node(c)
+        removed = weakref.ref(c)
+        del c
+        self.assertIs(graph.current_behavior_node, b, "The graph should still be sitting on the removed node")
+        self.assertIs(b.next_node, removed(), "A removed node should keep its successors alive")
+        self.assertIs(b.next_node.next_node, a)
+        self.assertEqual(graph.behavior_nodes, [a])
+
+    def test_pruned_nodes_pointing_at_each_other_are_freed_without_the_cycle_collector(self):
+        entry, first, second = (StatementNode(second_function) for _ in range(3))
+        entry.assign_edge(entry)
+        first.assign_edge(second)
+        second.assign_edge(first)
+        graph = BehaviorGraph()
+        graph.behavior_nodes = [entry, first, second]
+        graph.set_entry_node(entry)
+        pruned = [weakref.ref(first), weakref.ref(second)]
+        del first, second
+        gc.disable()
+        try:
+            self.assertEqual(graph.prune_unreachable(), 2)
+            self.assertTrue(all(node() is None for node in pruned),
+                            "Pruned nodes should be freed by reference counting")
+        finally:
+            gc.enable()
+
+
+class TestPruneUnreachable(unittest.TestCase):
+    def setUp(self):
+        self.entry, self.loop, self.orphan, self.stray = (StatementNode(second_function) for _ in range(4))
+        self.entry.assign_edge(self.loop)
+        self.loop.assign_edge(self.entry)
+        self.orphan.assign_edge(self.loop)
+        self.stray.assign_edge(self.stray)
+        self.graph = BehaviorGraph()
+        self.graph.behavior_nodes = [self.entry, self.orphan, self.loop, self.stray]
+        self.graph.set_entry_node(self.entry)
+
+    def test_prune_drops_unreachable_nodes(self):
+        self.assertEqual(self.graph.prune_unreachable(), 2, "Both unreachable nodes should be removed")
+        self.assertEqual(self.graph.behavior_nodes, [self.entry, self.loop], "Reachable nodes should keep their order")
+        self.assertNotIn(self.orphan.node_number, self.loop.incoming, "Pruned nodes should not count as incoming edges")
+        self.assertEqual(self.graph.prune_unreachable(), 0, "Pruning again should find nothing")
+
+    def test_prune_keeps_nodes_reachable_from_the_current_node(self):
+        self.graph.current_behavior_node = self.stray
+        self.assertEqual(self.graph.prune_unreachable(), 1)
+        self.assertEqual(self.graph.behavior_nodes, [self.entry, self.loop, self.stray])
+
+    def test_prune_copies_a_shared_genome(self):
+        child = self.graph.return_tree_copy()
+        self.assertEqual(child.prune_unreachable(), 2)
+        self.assertEqual(len(self.graph.behavior_nodes), 4, "The parent's shared genome should not be pruned")
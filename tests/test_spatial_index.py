@@ -0,0 +1,178 @@
+import unittest
+import numpy as np
+from simulation import World
+from sim_entities import Bot, Plant, Signal, StaticSignal
+from spatial_index import KDTreeIndex, GridIndex
+
+
+def populated_world(spatial_index, seed=3, boundary_sizes=None):
+    random_state = np.random.RandomState(seed)
+    world = World(spatial_index=spatial_index, boundary_sizes=boundary_sizes)
+    for x, y in random_state.uniform(-100, 100, size=(300, 2)):
+        world.add_entity(Plant(x, y))
+    for x, y in random_state.uniform(-100, 100, size=(50, 2)):
+        world.add_entity(Bot(x, y))
+    world.wrap_entity_positions()
+    world.aggregate_entities()
+    world.spatial_index.update()
+    return world
+
+
+class TestGridIndexMatchesKDTree(unittest.TestCase):
+    def setUp(self):
+        self.kd_world = populated_world(KDTreeIndex)
+        self.grid_world = populated_world(GridIndex)
+        self.query_points = np.random.RandomState(5).uniform(-110, 110, size=(40, 2))
+
+    def assert_same_radius_results(self):
+        for x, y in self.query_points:
+            for radius in (0.5, 3, 12, 40):
+                expected = sorted(self.kd_world.spatial_index.query_radius(x, y, radius))
+                found = sorted(self.grid_world.spatial_index.query_radius(x, y, radius))
+                self.assertEqual(expected, found, "Grid radius queries should match the kd-tree")
+
+    def test_radius_queries(self):
+        self.assert_same_radius_results()
+
+    def test_batched_radius_queries(self):
+        radii = np.random.RandomState(6).uniform(0, 20, size=len(self.query_points))
+        for world in (self.kd_world, self.grid_world):
+            results = world.spatial_index.query_radius_batch(self.query_points, radii)
+            for (x, y), radius, indexes in zip(self.query_points, radii, results):
+                self.assertEqual(sorted(indexes), sorted(world.spatial_index.query_radius(x, y, radius)),
+                                 "Batched queries should match single queries")
+
+    def test_nearest_queries(self):
+        for x, y in self.query_points:
+            expected, _ = self.kd_world.spatial_index.query_nearest(x, y, 15)
+            found, _ = self.grid_world.spatial_index.query_nearest(x, y, 15)
+            np.testing.assert_allclose(found, expected, err_msg="Grid k-nearest distances should match the kd-tree")
+
+    def test_radius_queries_after_movement_and_deaths(self):
+        for world in (self.kd_world, self.grid_world):
+            for bot in world.bots[::2]:
+                bot.x += 7
+                bot.y -= 30
+            for plant in world.plants[::3]:
+                plant.dead = True
+            world.remove_dead_entities()
+            world.wrap_entity_positions()
+            world.aggregate_entities()
+            world.spatial_index.update()
+        self.assert_same_radius_results()
+
+    def test_queries_after_plant_births_and_deaths(self):
+        random_state = np.random.RandomState(8)
+        for _ in range(6):
+            births = random_state.uniform(-100, 100, size=(20, 2))
+            for world in (self.kd_world, self.grid_world):
+                for plant in world.plants[::7]:
+                    plant.dead = True
+                world.remove_dead_entities()
+                for x, y in births:
+                    world.add_entity(Plant(x, y))
+                world.wrap_entity_positions()
+                world.aggregate_entities()
+                world.spatial_index.update()
+            self.assert_same_radius_results()
+            for x, y in self.query_points[:10]:
+                expected, _ = self.kd_world.spatial_index.query_nearest(x, y, 15)
+                found, _ = self.grid_world.spatial_index.query_nearest(x, y, 15)
+                np.testing.assert_allclose(found, expected, err_msg="Nearest queries should see births and deaths")
+
+    def test_nearest_with_fewer_entities_than_k(self):
+        for spatial_index in (KDTreeIndex, GridIndex):
+            world = World(spatial_index=spatial_index)
+            world.add_entity(Plant(1, 1))
+            world.aggregate_entities()
+            world.spatial_index.update()
+            nearest = world.query_nearest(0, 0, 15)
+            self.assertEqual(len(nearest), 1, "Only existing entities should be returned")
+            self.assertIs(nearest[0][1], world.plants[0], "The nearest entity should be the plant")
+
+
+class TestKindFilteredQueries(unittest.TestCase):
+    def test_radius_query_by_kind(self):
+        for spatial_index in (KDTreeIndex, GridIndex):
+            world = populated_world(spatial_index)
+            everything = world.query_radius(0, 0, 40)
+            bots = world.query_radius(0, 0, 40, kinds=(Bot,))
+            self.assertTrue(bots, "The populated world should have bots near the origin")
+            self.assertEqual(sorted(entity.entity_id for entity in bots),
+                             sorted(entity.entity_id for entity in everything if isinstance(entity, Bot)),
+                             "Filtered queries should find exactly the entities of that kind")
+
+    def test_nearest_query_by_kind(self):
+        for spatial_index in (KDTreeIndex, GridIndex):
+            world = populated_world(spatial_index)
+            nearest = world.query_nearest(0, 0, 3, kinds=(Bot,))
+            self.assertEqual(len(nearest), 3, "k entities of the requested kind should be returned")
+            self.assertTrue(all(isinstance(entity, Bot) for _, entity in nearest), "Only bots should be returned")
+            expected = sorted(world.query_radius(0, 0, nearest[-1][0] + 1e-9, kinds=(Bot,)),
+                              key=lambda bot: (bot.x ** 2 + bot.y ** 2))[:3]
+            self.assertEqual([entity for _, entity in nearest], expected, "The nearest bots should be returned")
+
+    def test_subclass_kind_is_filtered(self):
+        world = World()
+        owner = Bot(0, 0)
+        static_signal = StaticSignal(1, 0, owner)
+        world.add_entity(static_signal)
+        world.add_entity(Plant(0, 1))
+        world.aggregate_entities()
+        world.spatial_index.update()
+        self.assertEqual(world.query_radius(0, 0, 5, kinds=(Signal,)), [static_signal],
+                         "Querying a base kind should find its subclasses")
+        self.assertEqual(world.query_radius(0, 0, 5, kinds=(Bot,)), [], "Other kinds should be left out")
+
+class TestStaticPlantTree(unittest.TestCase):
+    def step_index(self, world):
+        world.remove_dead_entities()
+        world.aggregate_entities()
+        world.spatial_index.update()
+
+    def test_plant_tree_kept_while_plants_are_unchanged(self):
+        world = populated_world(KDTreeIndex)
+        static_tree = world.spatial_index.static_trees[world.plant_store]
+        bot_tree = world.spatial_index.trees[world.bot_store]
+        self.step_index(world)
+        self.assertIs(world.spatial_index.static_trees[world.plant_store], static_tree,
+                      "The plant tree should not be rebuilt when no plants were born or died")
+        self.assertIsNot(world.spatial_index.trees[world.bot_store], bot_tree, "Bots should be re-indexed every tick")
+
+    def test_few_changes_are_buffered_and_many_rebuild(self):
+        world = populated_world(KDTreeIndex)
+        static_tree = world.spatial_index.static_trees[world.plant_store]
+        newborn = Plant(500, 500)
+        world.add_entity(newborn)
+        world.plants[0].dead = True
+        dead = world.plants[0]
+        self.step_index(world)
+        self.assertIs(world.spatial_index.static_trees[world.plant_store], static_tree,
+                      "A few births and deaths should not rebuild the plant tree")
+        self.assertEqual(world.query_radius(500, 500, 1), [newborn], "Buffered newborns should be found")
+        self.assertNotIn(dead, world.query_radius(dead.x, dead.y, 1), "Removed plants should not be found")
+        for x in range(100):
+            world.add_entity(Plant(x, 0))
+        self.step_index(world)
+        self.assertIsNot(world.spatial_index.static_trees[world.plant_store], static_tree,
+                         "Many births should rebuild the plant tree")
+        self.assertEqual(world.query_radius(500, 500, 1), [newborn], "Rebuilt trees should keep every plant")
+
+class TestGridIndexMatchesKDTreeOnTorus(TestGridIndexMatchesKDTree):
+    def setUp(self):
+        self.kd_world = populated_world(KDTreeIndex, boundary_sizes=(150, 70))
+        self.grid_world = populated_world(GridIndex, boundary_sizes=(150, 70))
+        self.query_points = np.random.RandomState(5).uniform(-10, 160, size=(40, 2))
+
+
+class TestPeriodicQueries(unittest.TestCase):
+    def test_radius_query_across_seam(self):
+        for spatial_index in (KDTreeIndex, GridIndex):
+            world = World(boundary_sizes=(100, 100), spatial_index=spatial_index)
+            plant = Plant(99.5, 50)
+            world.add_entity(plant)
+            world.aggregate_entities()
+            world.spatial_index.update()
+            self.assertEqual(world.query_radius(0.5, 50, 2), [plant],
+                             "Radius queries should find entities just across the boundary")
+            self.assertEqual(world.query_radius(50, 50, 2), [], "Distant entities should not be found")
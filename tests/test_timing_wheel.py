@@ -0,0 +1,31 @@
+import unittest
+import numpy as np
+from timing_wheel import TimingWheel
+
+
+class TestTimingWheel(unittest.TestCase):
+    def test_ids_are_popped_at_their_tick(self):
+        wheel = TimingWheel(size=8)
+        wheel.schedule([3, 5, 3, 6], [10, 11, 12, 13])
+        wheel.schedule(5, 14)
+        self.assertEqual(len(wheel), 5)
+        self.assertEqual(wheel.pop(2).tolist(), [])
+        self.assertEqual(sorted(wheel.pop(3).tolist()), [10, 12])
+        self.assertEqual(sorted(wheel.pop(5).tolist()), [11, 14])
+        self.assertEqual(len(wheel), 1)
+
+    def test_ids_beyond_one_turn_wait_for_their_tick(self):
+        wheel = TimingWheel(size=4)
+        wheel.schedule([1, 5, 9], [1, 2, 3])
+        self.assertEqual(wheel.pop(1).tolist(), [1], "Later turns of the wheel should not be popped early")
+        self.assertEqual(wheel.pop(5).tolist(), [2])
+        self.assertEqual(wheel.pop(9).tolist(), [3])
+        self.assertEqual(len(wheel), 0)
+
+    def test_bad_size(self):
+        with self.assertRaises(ValueError):
+            TimingWheel(size=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,34 @@
+import gc
 import unittest
+import numpy as np
 from simulation import World
+from world import WorldWatcher
 from sim_entities import Bot, Plant, StaticSignal
+from intelligence import BehaviorGraph, StatementNode, ConditionalNode, NodeRegister
+import behavior_functions
+
+
+def idle_behavior():
+    node = StatementNode(lambda bot: None)
+    node.assign_edge(node)
+    behavior = BehaviorGraph()
+    behavior.behavior_nodes = [node]
+    behavior.set_entry_node(node)
+    return behavior
+
+
+def plant_world(energy_pool, plant_energies, seed, chance=None, **kwargs):
+    # A world with one plant per energy, spaced out along the x axis
+    world = World(energy_pool=energy_pool, seed=seed, **kwargs)
+    plants = []
+    for n, energy in enumerate(plant_energies):
+        plant = Plant(n * 10, 0)
+        if chance is not None:
+            plant.percent_reproduction_chance = chance
+        world.give_energy_to_entity(energy, plant)
+        world.add_entity(plant)
+        plants.append(plant)
+    return world, plants
 
 
 class TestParameterLimits(unittest.TestCase):
@@ -95,6 +123,85 @@ class TestWorldAddEntity(unittest.TestCase):
         self.assertFalse(world_no_limits.give_energy_to_entity(-5, self.plant),
                          "Should not be able to add entity with negative energy")
 
+    def test_add_entity_marks_entity_registered(self):
+        world = World()
+        self.assertFalse(self.plant.registered, "An entity should not be registered before it is added")
+        self.assertTrue(world.add_entity(self.plant), "Adding a new entity should succeed")
+        self.assertTrue(self.plant.registered, "An added entity should be registered")
+        self.assertTrue(world.add_entity(self.plant), "Adding an entity twice should report it is in the world")
+        self.assertEqual(len(world.plants), 1, "Adding an entity twice should not duplicate it")
+
+
+class TestWorldAddEntities(unittest.TestCase):
+    def test_add_entities_matches_add_entity(self):
+        world = World(boundary_sizes=(100, 100), energy_pool=100)
+        plant, bot = Plant(105, -5), Bot(3, 4, behavior_graph=idle_behavior())
+        plant.max_age = 40
+        self.assertEqual(world.add_entities([bot, plant]), [bot, plant])
+        self.assertEqual(world.plants, [plant])
+        self.assertEqual(world.bots, [bot])
+        self.assertEqual((plant.x, plant.y, plant.max_age, plant.birthday), (5, 95, 40, 0),
+                         "Positions should wrap and other values should be kept")
+        self.assertIs(world.get_entity(bot.entity_id), bot)
+        self.assertIsNotNone(bot.interned_genome, "Bots' brains should be interned")
+        self.assertEqual(world.add_entities([bot]), [], "Entities already in the world should be skipped")
+
+    def test_energies_are_given_in_order_from_the_pool(self):
+        world = World(energy_pool=25)
+        plants = [Plant(n, 0) for n in range(3)]
+        world.add_entities(plants, energies=[10, 10, 10])
+        self.assertEqual([plant.energy for plant in plants], [10, 10, 5])
+        self.assertEqual(world.energy_pool, 0)
+
+    def test_limits_are_enforced(self):
+        world = World(bot_limit=2, plant_limit=1, energy_pool=100)
+        bots = [Bot(n, 0, behavior_graph=idle_behavior()) for n in range(3)]
+        plants = [Plant(n, 0) for n in range(2)]
+        added = world.add_entities(bots + plants, energies=10)
+        self.assertEqual(added, bots[:2] + plants[:1])
+        self.assertEqual(world.energy_pool, 70, "Refused entities should not take energy")
+        self.assertEqual(bots[2].energy, 0)
+
+    def test_entities_created_from_positions(self):
+        world = World(boundary_sizes=(100, 100), energy_pool=100)
+        behavior = idle_behavior()
+        added = world.add_entities(positions=[(1, 2), (150, 3)], kinds=[Plant, Bot], energies=[5, 6], behavior=behavior)
+        self.assertEqual([type(entity) for entity in added], [Plant, Bot])
+        self.assertEqual([(entity.x, entity.y, entity.energy) for entity in added], [(1, 2, 5), (50, 3, 6)])
+        self.assertEqual(world.energy_pool, 89)
+        self.assertEqual(len(world.add_entities(positions=np.zeros((4, 2)), kinds=Plant)), 4)
+        self.assertIsNot(added[1].behavior, behavior, "Each bot should get its own copy of the behavior")
+        self.assertIs(added[1].behavior.entry_node, behavior.entry_node)
+        world.step()
+        self.assertFalse(added[1].dead, "Bots created from positions should be able to step")
+
+    def test_duplicates_are_added_once(self):
+        world = World(energy_pool=100)
+        plant, other = Plant(0, 0), Plant(1, 1)
+        self.assertEqual(world.add_entities([plant, other, plant], energies=[10, 20, 30]), [plant, other])
+        self.assertEqual(len(world.plant_store), 2, "An entity passed twice should take one row")
+        self.assertIs(world.plant_store.entities[plant._row], plant)
+        self.assertEqual((plant.energy, world.energy_pool), (10, 70), "Energy should only be given once")
+
+    def test_populate_without_bot_energy(self):
+        world = World(energy_pool=100)
+        world.populate(3, 0)
+        self.assertEqual(len(world.bots), 3, "Bots given no energy should not be capped by the pool")
+        self.assertEqual(world.energy_pool, 100)
+
+    def test_bad_arguments(self):
+        world = World()
+        with self.assertRaises(ValueError):
+            world.add_entities(positions=[(0, 0)], kinds=[StaticSignal])
+        with self.assertRaises(ValueError):
+            world.add_entities(positions=[(0, 0), (1, 1)], kinds=[Plant])
+        with self.assertRaises(ValueError):
+            world.add_entities(positions=[(0, 0)], kinds=Bot)
+        with self.assertRaises(ValueError):
+            world.add_entities([Plant(0, 0)], energies=[1, 2])
+        with self.assertRaises(ValueError):
+            world.add_entities([Plant(0, 0)], energies=-1)
+
 
 class TestWorldAggregateEntities(unittest.TestCase):
     def test_no_entities_added(self):
@@ -451,4 +558,596 @@ class TestWorldGetUnitVectorWithBounds(unittest.TestCase):
     # TODO: Unit test the other boundaries
 
 
-# TODO: Unit test the step method from World
\ No newline at end of file
+class TestWorldEntityStore(unittest.TestCase):
+    def setUp(self):
+        self.world = World(energy_pool=100)
+        self.bot = Bot(3, 4, behavior_graph=idle_behavior())
+        self.world.give_energy_to_entity(10, self.bot)
+        self.world.add_entity(self.bot)
+
+    def test_added_entity_reads_from_store(self):
+        row = self.world.bot_store.rows[self.bot.entity_id]
+        self.assertIs(self.world.bot_store.entities[row], self.bot, "The id-to-row map should point at the bot")
+        self.assertEqual(self.world.bot_store.column('energy')[row], 10, "Bot energy should be stored in its row")
+        self.bot.x = 7
+        self.assertEqual(self.world.bot_store.column('x')[row], 7, "Setting an attribute should write to the store")
+        self.assertIs(self.world.get_entity(self.bot.entity_id), self.bot, "Entities should be found by their id")
+
+    def test_step_ages_and_drains_bots(self):
+        self.world.step()
+        self.assertEqual(self.bot.age, 1, "Bots should age by one each tick")
+        self.assertEqual(self.bot.energy, 9, "Bots should lose one energy each tick")
+        self.assertEqual(self.world.energy_pool, 91, "Energy drained from bots should return to the pool")
+        self.assertEqual(self.bot.peak_energy, 9, "Peak energy should be tracked after the drain")
+
+    def test_dead_entity_is_removed_and_detached(self):
+        self.bot.age = self.bot.max_age - 1
+        self.world.step()
+        self.assertTrue(self.bot.dead, "Bots reaching their maximum age should die")
+        self.world.step()
+        self.assertNotIn(self.bot, self.world.bots, "Dead bots should be removed on the next tick")
+        self.assertIn(self.bot, self.world.recently_dead_bots, "Removed bots should be reported as recently dead")
+        self.assertEqual(self.world.energy_pool, 100, "A dead bot's energy should return to the pool")
+        self.assertEqual(self.bot.age, self.bot.max_age, "A removed bot should keep its final values")
+
+    def test_dead_entity_is_swapped_with_last_row(self):
+        bots = [self.bot]
+        for n in range(3):
+            bot = Bot(n, 0, behavior_graph=idle_behavior())
+            self.world.give_energy_to_entity(10, bot)
+            self.world.add_entity(bot)
+            bots.append(bot)
+        bots[1].dead = True
+        self.world.remove_dead_entities()
+        store = self.world.bot_store
+        self.assertEqual(store.entities, [bots[0], bots[3], bots[2]], "The last bot should fill the removed row")
+        for row, bot in enumerate(store.entities):
+            self.assertEqual(store.rows[bot.entity_id], row, "The id-to-row map should follow moved bots")
+            self.assertEqual(bot.x, store.column('x')[row], "Moved bots should keep their own values")
+
+
+class TestWorldAgeOutDeaths(unittest.TestCase):
+    def add_to_new_world(self, *entities):
+        world = World(energy_pool=1000)
+        for entity in entities:
+            world.give_energy_to_entity(100, entity)
+            world.add_entity(entity)
+        return world
+
+    def death_tick(self, world, entity):
+        for tick in range(1, 20):
+            world.step()
+            if entity.dead:
+                return tick
+
+    def test_each_kind_dies_on_its_usual_tick(self):
+        bot, plant = Bot(0, 0, behavior_graph=idle_behavior()), Plant(5, 5)
+        bot.max_age = plant.max_age = 3
+        signal = StaticSignal(0, 0, bot, max_age=3)
+        self.assertEqual(self.death_tick(self.add_to_new_world(bot), bot), 3,
+                         "Bots should die on the tick they reach max_age")
+        self.assertEqual(self.death_tick(self.add_to_new_world(plant), plant), 5,
+                         "Plants should die on the tick after they pass max_age")
+        self.assertEqual(self.death_tick(self.add_to_new_world(signal), signal), 4,
+                         "Signals should die on the tick they pass max_age")
+
+    def test_changing_age_limits_reschedules_death(self):
+        early, late = Plant(0, 0), Plant(5, 5)
+        early.max_age = late.max_age = 10
+        world = self.add_to_new_world(early, late)
+        world.step()
+        early.max_age = 1
+        late.age = -5
+        self.assertEqual(self.death_tick(world, early), 2, "Lowering max_age should bring death forward")
+        self.assertEqual(self.death_tick(world, late), 15, "Lowering age should put death back")
+        self.assertEqual(late.age, 12)
+
+
+class TestWorldPlantPhase(unittest.TestCase):
+    def create_world(self, energy_pool, plant_energies, **kwargs):
+        world, self.plants = plant_world(energy_pool, plant_energies, 2, **kwargs)
+        return world
+
+    def total_energy(self, world):
+        return world.energy_pool + sum(plant.energy for plant in world.plants)
+
+    def test_growth_is_capped_and_served_in_row_order(self):
+        world = self.create_world(680, [10, 595, 20, 30])
+        world.step()
+        self.assertEqual([plant.energy for plant in self.plants], [25, 600, 25, 30],
+                         "Plants should grow up to max_energy and stop when the pool runs dry")
+        self.assertEqual(world.energy_pool, 0)
+
+    def test_reproduction_spawns_children_in_bulk(self):
+        world = self.create_world(20000, [600] * 20)
+        for plant in self.plants:
+            plant.percent_reproduction_chance = 101
+        before = self.total_energy(world)
+        world.step()
+        children = world.plants[20:]
+        self.assertEqual(len(children), 20, "Every plant should reproduce when the roll always succeeds")
+        self.assertEqual(self.total_energy(world), before, "Reproduction should conserve energy")
+        for child in children:
+            self.assertEqual((child.energy, child.birthday, child.max_age), (100, world.tick_number, 2000))
+            self.assertIs(world.get_entity(child.entity_id), child)
+        self.assertEqual({plant.number_children for plant in self.plants}, {1})
+        self.assertTrue(all(plant.energy == 500 for plant in self.plants), "Parents should pay the investment")
+        world.aggregate_entities()
+        world.spatial_index.update()
+        child = children[-1]
+        self.assertIn(child, world.query_radius(child.x, child.y, 0.5, kinds=(Plant,)),
+                      "Bulk-added plants should be indexed")
+
+    def test_reproduction_respects_plant_limit(self):
+        world = self.create_world(10000, [600] * 5, plant_limit=7)
+        for plant in self.plants:
+            plant.percent_reproduction_chance = 101
+        world.step()
+        self.assertEqual(len(world.plants), 7)
+        self.assertEqual(sum(plant.energy for plant in self.plants), 5 * 600 - 2 * 100,
+                         "Only plants whose child was placed should pay for it")
+
+    def test_unknown_plant_execution(self):
+        with self.assertRaises(ValueError):
+            World(plant_execution='threaded')
+
+
+class TestWorldDormantPlants(unittest.TestCase):
+    def create_world(self, energy_pool, plant_energies, plant_execution='dormant', chance=0):
+        world, self.plants = plant_world(energy_pool, plant_energies, 4, chance, plant_execution=plant_execution)
+        return world
+
+    def awake(self, world):
+        rows = world.dormant_plants.awake_rows(len(world.plant_store))
+        return [world.plants[row] for row in rows]
+
+    def test_growth_matches_vectorized(self):
+        worlds = [self.create_world(700, [10, 595, 20, 600, 30], plant_execution=mode)
+                  for mode in ('vectorized', 'dormant')]
+        for tick in range(30):
+            for world in worlds:
+                world.step()
+            self.assertEqual([plant.energy for plant in worlds[0].plants],
+                             [plant.energy for plant in worlds[1].plants])
+            self.assertEqual(worlds[0].energy_pool, worlds[1].energy_pool)
+
+    def test_saturated_plants_sleep_until_eaten(self):
+        world = self.create_world(1000, [600, 300])
+        world.step()
+        self.assertEqual(self.awake(world), [self.plants[1]], "Plants at max_energy should go dormant")
+        bot = Bot(0, 0, behavior_graph=idle_behavior())
+        world.add_entity(bot)
+        world.transfer_energy_between_entities(100, donor=self.plants[0], recipient=bot)
+        self.assertEqual(self.awake(world), self.plants, "Eaten plants should wake")
+        world.step()
+        self.assertEqual(self.plants[0].energy, 515)
+
+    def test_starved_plants_wake_when_pool_refills(self):
+        world = self.create_world(0, [0, 0])
+        world.step()
+        self.assertEqual(self.awake(world), [], "Plants should go dormant when the pool is empty")
+        bot = Bot(0, 0, behavior_graph=idle_behavior())
+        bot.energy = 40
+        world.add_entity(bot)
+        world.drain_energy_from_entity(20, bot)
+        self.assertEqual(self.awake(world), self.plants, "Plants should wake when energy returns to the pool")
+        world.step()
+        self.assertEqual([plant.energy for plant in self.plants], [15, 5])
+
+    def test_reproduction_roll_comes_due(self):
+        world = self.create_world(10000, [600], chance=20)
+        while world.plant_store.column('wake_tick')[0] < 0:
+            world.step()
+        due = world.plant_store.column('wake_tick')[0]
+        while world.tick_number < due:
+            self.assertEqual(len(world.plants), 1)
+            self.assertEqual(self.awake(world), [])
+            world.step()
+        self.assertEqual(len(world.plants), 2, "A dormant plant should reproduce when its drawn roll comes due")
+        self.assertEqual(self.plants[0].energy, 500)
+
+    def test_reproduction_rate_matches_rolls(self):
+        world = self.create_world(None, [600] * 200, chance=10)
+        for tick in range(20):
+            world.step()
+        children = sum(plant.number_children for plant in self.plants)
+        # Each tick a saturated plant reproduces with chance 10/101, and children take several ticks to grow
+        self.assertTrue(200 * 20 * 10 / 101 * 0.6 < children < 200 * 20 * 10 / 101 * 1.4, children)
+
+
+class TestWorldPlantInterval(unittest.TestCase):
+    def test_plants_step_every_interval(self):
+        for plant_execution in ('vectorized', 'dormant'):
+            world = World(energy_pool=1000, plant_interval=3, plant_execution=plant_execution)
+            plant = Plant(0, 0)
+            plant.percent_reproduction_chance = 0
+            world.add_entity(plant)
+            energies = []
+            for tick in range(6):
+                world.step()
+                energies.append(plant.energy)
+            self.assertEqual(energies, [0, 0, 45, 45, 45, 90], "Plants should grow for the whole interval at once")
+            self.assertEqual(plant.age, 6, "Plants should age for the whole interval at once")
+
+    def test_plants_die_within_the_interval_they_age_out(self):
+        world = World(plant_interval=4)
+        plant = Plant(0, 0)
+        plant.max_age = 5
+        world.add_entity(plant)
+        for tick in range(7):
+            world.step()
+            self.assertFalse(plant.dead)
+        world.step()
+        self.assertTrue(plant.dead, "A plant reaching its death age between steps should die at the next step")
+
+    def test_reproduction_chance_covers_the_interval(self):
+        self.assertAlmostEqual(Plant.reproduction_chance(10), 10 / 101)
+        self.assertAlmostEqual(Plant.reproduction_chance(10, 3), 1 - (91 / 101) ** 3)
+        self.assertEqual(Plant.reproduction_chance(150, 2), 1)
+
+    def test_bad_plant_interval(self):
+        with self.assertRaises(ValueError):
+            World(plant_interval=0)
+        with self.assertRaises(ValueError):
+            World(plant_interval=2, plant_execution='per_plant')
+
+
+class TestWorldWatcherAccuracyReport(unittest.TestCase):
+    def create_watcher(self, plant_numbers):
+        watcher = WorldWatcher(World())
+        watcher.plant_numbers = plant_numbers
+        watcher.bot_numbers = [10] * len(plant_numbers)
+        watcher.signal_numbers = [0] * len(plant_numbers)
+        watcher.species_numbers = [2] * len(plant_numbers)
+        return watcher
+
+    def test_curves_are_compared_poll_by_poll(self):
+        reference = self.create_watcher([100, 200, 300, 400])
+        report = self.create_watcher([110, 200, 270]).accuracy_report(reference)
+        self.assertEqual(report['plant_numbers'].mean, 580 / 3)
+        self.assertEqual(report['plant_numbers'].reference_mean, 200)
+        self.assertAlmostEqual(report['plant_numbers'].mean_error, 40 / 3 / 200)
+        self.assertAlmostEqual(report['plant_numbers'].max_error, 30 / 200)
+        self.assertEqual(report['bot_numbers'].max_error, 0)
+        self.assertEqual(report['signal_numbers'].max_error, 0, "Empty populations should not divide by zero")
+
+    def test_gc_timing_is_opt_in_and_closed(self):
+        hooks = len(gc.callbacks)
+        self.create_watcher([1])
+        self.assertEqual(len(gc.callbacks), hooks, "Watchers should not time collections unless asked to")
+        watcher = WorldWatcher(World(), time_gc=True)
+        self.assertEqual(len(gc.callbacks), hooks + 1)
+        watcher.poll_world_for_data()
+        watcher.close()
+        watcher.close()
+        self.assertEqual(len(gc.callbacks), hooks, "Closing a watcher should unhook its timer")
+        self.assertEqual(len(watcher.gc_pause_times), 1)
+
+    def test_watchers_must_have_polled(self):
+        with self.assertRaises(ValueError):
+            self.create_watcher([]).accuracy_report(self.create_watcher([1]))
+
+
+class TestWorldSignalDetection(unittest.TestCase):
+    def create_world(self, signal_detection):
+        world = World(signal_detection=signal_detection)
+        bot = Bot(0, 0, behavior_graph=idle_behavior())
+        world.give_energy_to_entity(100, bot)
+        world.add_entity(bot)
+        self.near_plant, self.far_plant = Plant(2, 0), Plant(30, 0)
+        world.add_entity(self.near_plant)
+        world.add_entity(self.far_plant)
+        self.signal = StaticSignal(0, 0, bot)
+        self.signal.diameter = 8
+        world.give_energy_to_entity(5, self.signal)
+        world.add_entity(self.signal)
+        return world
+
+    def check_detection(self, world):
+        self.assertIn(self.near_plant, self.signal.detected_objects,
+                      "Signals should detect entities within their radius")
+        self.assertNotIn(self.far_plant, self.signal.detected_objects, "Signals should not detect distant entities")
+        world.step()
+        self.assertIn(self.near_plant, self.signal.detected_objects,
+                      "Detected entities should stay valid after all_entities is rebuilt")
+
+    def test_signals_detect_entities_in_one_batch(self):
+        world = self.create_world('batched')
+        world.step()
+        self.assertEqual(self.signal._detected_tick, world.tick_number + 1,
+                         "Batched detection should be kept for the next tick's bots")
+        self.check_detection(world)
+
+    def count_queries(self, signal_detection, ticks=10):
+        world = self.create_world(signal_detection)
+        self.signal.max_age = 100
+        reader = StatementNode(lambda bot: self.signal.detected_of(Plant))
+        reader.assign_edge(reader)
+        world.bots[0].behavior.behavior_nodes = [reader]
+        world.bots[0].behavior.set_entry_node(reader)
+        counts = {'single': 0, 'batch': 0}
+        index = world.spatial_index
+        for name, method in (('single', 'query_radius'), ('batch', 'query_radius_batch')):
+            def counted(*args, name=name, original=getattr(index, method), **kwargs):
+                counts[name] += 1
+                return original(*args, **kwargs)
+            setattr(index, method, counted)
+        for tick in range(ticks):
+            world.step()
+        return counts
+
+    def test_batched_detection_is_read_by_the_next_tick(self):
+        self.assertEqual(self.count_queries('lazy'), {'single': 10, 'batch': 0})
+        self.assertEqual(self.count_queries('batched'), {'single': 1, 'batch': 10},
+                         "Bots should read the batched detections instead of querying again")
+
+    def test_signals_detect_entities_lazily(self):
+        world = self.create_world('lazy')
+        world.step()
+        self.assertIsNone(self.signal._detected_tick, "Lazy detection should not run until it is read")
+        self.check_detection(world)
+        self.assertEqual(self.signal._detected_tick, world.tick_number, "Reading detection should cache it")
+
+    def test_detection_filtered_by_kind(self):
+        world = self.create_world('lazy')
+        world.step()
+        self.assertEqual(self.signal.detected_of(Plant), [self.near_plant],
+                         "Signals should detect entities of one kind without a full detection")
+        self.assertEqual(self.signal.detected_of(Bot), [self.signal.owner], "Only bots should be returned")
+        self.assertIsNone(self.signal._detected_tick, "Filtered detection should not run a full detection")
+
+    def test_unknown_detection_mode(self):
+        with self.assertRaises(ValueError):
+            World(signal_detection='eager')
+
+    def test_dead_signals_drop_their_detections(self):
+        world = self.create_world('lazy')
+        world.step()
+        self.assertIn(self.signal, self.signal.detected_objects)
+        self.signal.dead = True
+        world.remove_dead_entities()
+        self.assertEqual(self.signal._detected_objects, [], "A dead signal should not keep the entities it detected")
+        self.assertIsNone(self.signal._detected_from)
+
+    def test_signal_does_not_keep_its_owner_alive(self):
+        owner = Bot(0, 0, behavior_graph=idle_behavior())
+        signal = StaticSignal(0, 0, owner)
+        owner.signal = signal
+        self.assertIs(signal.owner, owner)
+        del owner
+        self.assertIsNone(signal.owner, "The owner should be freed without waiting for the cycle collector")
+
+
+class TestWorldQueryAround(unittest.TestCase):
+    def create_world(self, record_effects=False):
+        world = World(energy_pool=100, record_effects=record_effects)
+        self.bot = Bot(0, 0, behavior_graph=idle_behavior())
+        world.add_entity(self.bot)
+        world.give_energy_to_entity(10, self.bot)
+        self.near_plant, self.far_plant = Plant(2, 0), Plant(30, 0)
+        world.add_entity(self.near_plant)
+        world.add_entity(self.far_plant)
+        world.aggregate_entities()
+        world.spatial_index.update()
+        return world
+
+    def test_query_charges_without_creating_signals(self):
+        world = self.create_world()
+        found = world.query_around(self.bot, 3, kinds=(Plant,), cost=3)
+        self.assertEqual(found, [self.near_plant], "Only nearby entities of the requested kinds should be found")
+        self.assertEqual(self.bot.energy, 7, "The querying entity should be charged the cost")
+        self.assertEqual(world.energy_pool, 93, "The charged energy should go back to the pool")
+        self.assertEqual(len(world.signals), 0, "No signal entity should be created")
+        self.assertEqual(world.effects, [], "Effects should not be recorded unless asked for")
+
+    def test_query_excludes_the_querying_entity(self):
+        world = self.create_world()
+        self.assertNotIn(self.bot, world.query_around(self.bot, 3), "An entity should not find itself")
+
+    def test_effects_recorded_when_enabled(self):
+        world = self.create_world(record_effects=True)
+        world.query_around(self.bot, 3, color=(1, 2, 3))
+        self.assertEqual(world.effects, [(0, 0, 3, (1, 2, 3))], "The query should be recorded as an effect")
+        world.step()
+        self.assertEqual(world.effects, [], "Effects should only last for one tick")
+
+
+class TestWorldBrainExecution(unittest.TestCase):
+    def create_world(self, brain_execution, brain_budget=1):
+        world = World(brain_execution=brain_execution, brain_budget=brain_budget)
+        for energy in (50, 150, 90, 300):
+            check_energy = ConditionalNode(behavior_functions.very_low_energy)
+            wait = StatementNode(behavior_functions.wait)
+            move = StatementNode(behavior_functions.move_towards_target)
+            check_energy.assign_edges(wait, move)
+            wait.assign_edge(check_energy)
+            move.assign_edge(check_energy)
+            behavior = BehaviorGraph()
+            behavior.behavior_nodes = [check_energy, wait, move]
+            behavior.set_entry_node(check_energy)
+            bot = Bot(0, 0, behavior_graph=behavior)
+            bot.target_point = 10, 0
+            world.add_entity(bot)
+            world.give_energy_to_entity(energy, bot)
+        return world
+
+    def test_wavefront_matches_per_bot(self):
+        per_bot, wavefront = self.create_world('per_bot'), self.create_world('wavefront')
+        for _ in range(5):
+            per_bot.step()
+            wavefront.step()
+            self.assertEqual([(bot.x, bot.energy, bot.behavior.current_index) for bot in per_bot.bots],
+                             [(bot.x, bot.energy, bot.behavior.current_index) for bot in wavefront.bots],
+                             "Wavefront execution should leave bots where per-bot execution does")
+
+    def test_wavefront_calls_batch_functions_once_per_group(self):
+        calls = []
+        batch_function = NodeRegister.batch_functions[NodeRegister.function_id(behavior_functions.very_low_energy)]
+
+        def counting_batch(store, rows, bots):
+            calls.append(len(bots))
+            return batch_function(store, rows, bots)
+        NodeRegister.register_batch(behavior_functions.very_low_energy, counting_batch)
+        try:
+            world = self.create_world('wavefront')
+            world.step()
+        finally:
+            NodeRegister.register_batch(behavior_functions.very_low_energy, batch_function)
+        self.assertEqual(calls, [4], "Every bot on the same function should be stepped in one batch call")
+
+    def test_wavefront_matches_per_bot_with_a_budget(self):
+        per_bot, wavefront = self.create_world('per_bot', 3), self.create_world('wavefront', 3)
+        for _ in range(5):
+            per_bot.step()
+            wavefront.step()
+            self.assertEqual([(bot.x, bot.energy, bot.behavior.current_index) for bot in per_bot.bots],
+                             [(bot.x, bot.energy, bot.behavior.current_index) for bot in wavefront.bots])
+
+    def test_budget_runs_pure_conditionals_and_one_statement(self):
+        world = self.create_world('per_bot', 3)
+        world.step()
+        self.assertEqual([bot.x for bot in world.bots], [0, 1, 0, 1],
+                         "Bots should check their energy and act in the same tick")
+        self.assertEqual({bot.behavior.current_index for bot in world.bots}, {0})
+
+    def test_budget_stops_pure_cycles_of_uncompiled_brains(self):
+        calls = {}
+        for brain_execution in ('per_bot', 'wavefront'):
+            calls[brain_execution] = ran = []
+            a = ConditionalNode(lambda bot: ran.append('a') or True)
+            b = ConditionalNode(lambda bot: ran.append('b') or True)
+            a.assign_edges(b, b)
+            b.assign_edges(a, a)
+            NodeRegister.pure_conditionals.update((a.function, b.function))
+            try:
+                world = World(brain_execution=brain_execution, brain_budget=10)
+                behavior = BehaviorGraph()
+                behavior.behavior_nodes = [a, b]
+                behavior.set_entry_node(a)
+                world.add_entity(Bot(0, 0, behavior_graph=behavior))
+                world.give_energy_to_entity(100, world.bots[0])
+                self.assertIsNone(behavior.current_index, "The brain should not be compiled before the first step")
+                world.step()
+            finally:
+                NodeRegister.pure_conditionals.difference_update((a.function, b.function))
+        self.assertEqual(calls, {'per_bot': ['a', 'b'], 'wavefront': ['a', 'b']},
+                         "Both modes should stop a pure cycle before a node runs twice")
+
+    def test_bots_killed_after_the_store_grows_do_not_act(self):
+        def looping_brain(function):
+            node = StatementNode(function)
+            node.assign_edge(node)
+            behavior = BehaviorGraph()
+            behavior.behavior_nodes = [node]
+            behavior.set_entry_node(node)
+            return behavior
+
+        def grow(bot):
+            for _ in range(bot.world.bot_store.capacity):
+                bot.world.add_entity(Bot(0, 0, behavior_graph=idle_behavior()))
+
+        def kill(bot):
+            bot.world.transfer_energy_between_entities(victim.energy, donor=victim, recipient=bot)
+
+        def act(bot):
+            acted.append(brain_execution)
+        # Groups run in function id order, so the store grows before the victim is killed
+        for function in (grow, kill, act):
+            NodeRegister.function_id(function)
+        acted = []
+        for brain_execution in ('per_bot', 'wavefront'):
+            world = World(brain_execution=brain_execution)
+            for function in (grow, kill, act):
+                bot = Bot(0, 0, behavior_graph=looping_brain(function))
+                world.add_entity(bot)
+                world.give_energy_to_entity(100, bot)
+                victim = bot
+            capacity = world.bot_store.capacity
+            world.step()
+            self.assertGreater(world.bot_store.capacity, capacity, "The store should have grown during the tick")
+            self.assertTrue(victim.dead)
+        self.assertEqual(acted, [], "A bot killed earlier in the tick should not act, even after the store grew")
+
+    def test_unknown_brain_execution(self):
+        with self.assertRaises(ValueError):
+            World(brain_execution='threaded')
+
+    def test_budget_below_one(self):
+        with self.assertRaises(ValueError):
+            World(brain_budget=0)
+
+
+class TestWorldSpecies(unittest.TestCase):
+    def test_species_count_follows_births_and_deaths(self):
+        world = World()
+        parent = Bot(0, 0, behavior_graph=idle_behavior())
+        clone = Bot(1, 1, behavior_graph=parent.behavior.return_tree_copy())
+        stranger = Bot(2, 2, behavior_graph=idle_behavior())
+        other = Bot(3, 3, behavior_graph=BehaviorGraph())
+        other.behavior.behavior_nodes = [StatementNode(behavior_functions.wait)]
+        other.behavior.set_entry_node(other.behavior.behavior_nodes[0])
+        for bot in (parent, clone, stranger, other):
+            world.add_entity(bot)
+        self.assertEqual(world.species_count(), 3, "Clones should count as one species")
+        self.assertIs(clone.behavior.genome, parent.behavior.genome)
+        other.dead = True
+        world.remove_dead_entities()
+        self.assertEqual(world.species_count(), 2, "Species with no living bots should not be counted")
+
+
+class TestWorldMutation(unittest.TestCase):
+    def populated_world(self, seed):
+        world = World(boundary_sizes=(100, 100), energy_pool=1000, seed=seed)
+        world.populate(5, 10)
+        return world
+
+    def test_seeded_worlds_populate_identically(self):
+        first, second = self.populated_world(8), self.populated_world(8)
+        self.assertEqual([(bot.x, bot.y) for bot in first.bots], [(bot.x, bot.y) for bot in second.bots])
+        self.assertEqual([bot.behavior.genome.canonical_key() for bot in first.bots],
+                         [bot.behavior.genome.canonical_key() for bot in second.bots],
+                         "A seeded world should generate the same brains")
+
+    def test_offspring_are_mutated_after_the_bots_step(self):
+        world = World(energy_pool=100, seed=1)
+        parent = Bot(0, 0, behavior_graph=idle_behavior())
+        world.add_entity(parent)
+        child = Bot(1, 0, behavior_graph=parent.behavior.return_tree_copy())
+        world.add_entity(child)
+        world.mutate_later(child)
+        self.assertIs(child.behavior.genome, parent.behavior.genome, "Mutation should wait for the batch")
+        batches = []
+        mutate_batch = world.mutation_engine.mutate_batch
+        world.mutation_engine.mutate_batch = lambda graphs: batches.append(graphs) or mutate_batch(graphs)
+        world.mutate_pending()
+        self.assertEqual(batches, [[child.behavior]], "Queued brains should be mutated in one batch")
+        self.assertEqual(world.pending_mutations, [])
+        self.assertIs(world.genomes.genomes[child.interned_genome.key], child.interned_genome,
+                      "The mutated brain should be interned again")
+        self.assertEqual(sum(genome.refcount for genome in world.genomes.genomes.values()), 2,
+                         "Each bot should be counted once")
+
+
+class TestWorldBrainPruning(unittest.TestCase):
+    def bot_with_orphan_node(self):
+        bot = Bot(0, 0, behavior_graph=idle_behavior())
+        orphan = StatementNode(behavior_functions.wait)
+        orphan.assign_edge(bot.behavior.entry_node)
+        bot.behavior.behavior_nodes.append(orphan)
+        return bot
+
+    def test_new_brains_are_pruned_when_enabled(self):
+        world = World(prune_brains=True)
+        bot = self.bot_with_orphan_node()
+        world.add_entity(bot)
+        self.assertEqual(len(bot.behavior.behavior_nodes), 1, "The unreachable node should be pruned")
+        self.assertEqual((world.pruned_brains, world.pruned_nodes), (1, 1), "Pruning should be counted")
+
+    def test_brains_are_kept_whole_by_default(self):
+        world = World()
+        bot = self.bot_with_orphan_node()
+        world.add_entity(bot)
+        self.assertEqual(len(bot.behavior.behavior_nodes), 2, "Brains should not be pruned unless asked")
+
+
+# TODO: Unit test the step method from World
@@ -0,0 +1,39 @@
+import numpy as np
+
+
+class TimingWheel:
+    # Ids scheduled for future ticks, kept in a ring of slots indexed by tick. An id due more than size ticks ahead
+    # shares its slot with nearer ones and is passed over until its own turn comes round.
+    def __init__(self, size=4096):
+        if size < 1:
+            raise ValueError("Timing wheel size must be at least 1, not %s" % size)
+        self.size = size
+        self.slots = [[] for _ in range(size)]
+
+    def __len__(self):
+        return sum(len(ids) for slot in self.slots for ticks, ids in slot)
+
+    def schedule(self, ticks, ids):
+        ticks = np.atleast_1d(np.asarray(ticks, dtype=np.int64))
+        ids = np.atleast_1d(np.asarray(ids, dtype=np.int64))
+        if len(ticks) == 1:
+            self.slots[ticks.item() % self.size].append((ticks, ids))
+            return
+        slots = ticks % self.size
+        order = np.argsort(slots, kind='stable')
+        slots, ticks, ids = slots[order], ticks[order], ids[order]
+        bounds = (np.flatnonzero(np.diff(slots)) + 1).tolist()
+        for start, end in zip([0] + bounds, bounds + [len(slots)]):
+            self.slots[slots.item(start)].append((ticks[start:end], ids[start:end]))
+
+    def pop(self, tick):
+        # Removes and returns the ids due at tick
+        position = tick % self.size
+        slot = self.slots[position]
+        if not slot:
+            return np.empty(0, dtype=np.int64)
+        ticks = np.concatenate([ticks for ticks, ids in slot])
+        ids = np.concatenate([ids for ticks, ids in slot])
+        due = ticks <= tick
+        self.slots[position] = [] if due.all() else [(ticks[~due], ids[~due])]
+        return ids[due]
@@ -1,12 +1,16 @@
+import gc
 import os
 import csv
 import time
 import math
 import numpy as np
+from collections import namedtuple
 from sim_entities import Bot, Plant, Signal
-from intelligence import BehaviorGraph
-from random import randint
-from scipy.spatial import cKDTree
+from entity_store import EntityStore
+from timing_wheel import TimingWheel
+from dormant_plants import DormantPlants
+from spatial_index import KDTreeIndex
+from intelligence import BehaviorGraph, GenomeTable, MutationEngine, step_wavefront
 from matplotlib import pyplot as plt
 import matplotlib.gridspec as gridspec
 from intelligence import NodeRegister
@@ -26,15 +30,28 @@ except:
         print("Also could not load networkx module")
         print("Intelligence graphing is disabled")
 
+# A proximity query made by a behavior, kept only so it can be drawn
+Effect = namedtuple('Effect', 'x y radius color')
+# How closely one population curve follows a reference curve. Errors are relative to the reference mean.
+CurveAccuracy = namedtuple('CurveAccuracy', 'mean reference_mean mean_error max_error')
+
 
 class World:
-    def __init__(self, bot_limit=None, plant_limit=None, boundary_sizes=None, energy_pool=None):
+    def __init__(self, bot_limit=None, plant_limit=None, boundary_sizes=None, energy_pool=None, spatial_index=None,
+                 signal_detection='lazy', record_effects=False, brain_execution='per_bot', prune_brains=False,
+                 seed=None, brain_budget=1, plant_execution='vectorized', plant_interval=1):
         self.tick_number = 0
         self.start_time = time.time()
         self.time = time.time()
-        self.bots = []
-        self.plants = []
-        self.signals = []
+        self.next_entity_id = 0
+        # Columnar storage for each kind of entity. The world's entity lists are the stores' row-ordered entities.
+        self.plant_store = EntityStore(Plant)
+        self.bot_store = EntityStore(Bot)
+        self.signal_store = EntityStore(Signal)
+        self.stores = (self.plant_store, self.bot_store, self.signal_store)
+        self.plants = self.plant_store.entities
+        self.bots = self.bot_store.entities
+        self.signals = self.signal_store.entities
         self.bot_limit = bot_limit
         self.plant_limit = plant_limit
         self.boundary_sizes = boundary_sizes
@@ -44,58 +61,225 @@ class World:
             self.half_boundaries = self.boundary_sizes[0]/2, self.boundary_sizes[1]/2
         self.energy_pool = energy_pool
         self.initialized_energy = self.energy_pool
-        self.kd_tree = None
         self.all_entities = []
         self.recently_dead_bots = []
+        # Age-out deaths of each store, indexed by the store clock reading they are due at
+        self.death_wheels = {store: TimingWheel() for store in self.stores}
+        # The spatial index backend is built from the world, e.g. KDTreeIndex or GridIndex
+        if spatial_index is None:
+            spatial_index = KDTreeIndex
+        self.spatial_index = spatial_index(self)
+        self.index_tick = None
+        # 'lazy' signals query the spatial index when a behavior first reads what they detected, 'batched' resolves
+        # every signal in one query each tick
+        if signal_detection not in ('lazy', 'batched'):
+            raise ValueError("Signal detection must be 'lazy' or 'batched', not %s" % signal_detection)
+        self.signal_detection = signal_detection
+        # 'per_bot' steps each bot's behavior in turn, 'wavefront' steps all bots sitting on the same function at once
+        if brain_execution not in ('per_bot', 'wavefront'):
+            raise ValueError("Brain execution must be 'per_bot' or 'wavefront', not %s" % brain_execution)
+        self.brain_execution = brain_execution
+        # 'vectorized' grows and reproduces every plant with array operations, 'per_plant' calls each plant's step and
+        # 'dormant' steps only the plants that can change with array operations
+        if plant_execution not in ('vectorized', 'per_plant', 'dormant'):
+            raise ValueError("Plant execution must be 'vectorized', 'per_plant' or 'dormant', not %s" % plant_execution)
+        self.plant_execution = plant_execution
+        self.dormant_plants = DormantPlants(self, self.plant_store) if plant_execution == 'dormant' else None
+        # Plants are stepped every plant_interval ticks, and grow, age and roll to reproduce for all of them at once
+        if plant_interval < 1:
+            raise ValueError("Plant interval must be at least 1, not %s" % plant_interval)
+        if plant_interval > 1 and plant_execution == 'per_plant':
+            raise ValueError("Per-plant execution steps plants every tick, so the plant interval must be 1")
+        self.plant_interval = plant_interval
+        # Most behavior nodes a bot runs per tick. Past the first node a bot only carries on after a pure conditional.
+        if brain_budget < 1:
+            raise ValueError("Brain budget must be at least 1, not %s" % brain_budget)
+        self.brain_budget = brain_budget
+        # Structurally identical brains of bots in the world share one interned genome
+        self.genomes = GenomeTable()
+        # With prune_brains, nodes a new bot's brain can never reach again are dropped when it joins the world.
+        # Shared genomes are left alone, since pruning one would mean copying it.
+        self.prune_brains = prune_brains
+        self.pruned_brains = 0
+        self.pruned_nodes = 0
+        # Randomness for populating the world and for mutating offspring comes from one generator, so a seeded world
+        # repeats its brains and mutations
+        self.rng = np.random.default_rng(seed)
+        self.mutation_engine = MutationEngine(self.rng)
+        # Bots whose brains are mutated together after the bots have stepped
+        self.pending_mutations = []
+        # Effects from this tick's proximity queries, only collected when something will draw them
+        self.record_effects = record_effects
+        self.effects = []
 
     def step(self):
         self.time = time.time() - self.start_time
         self.tick_number += 1
         self.recently_dead_bots = []
+        self.effects = []
+        self.remove_dead_entities()
+        self.wrap_entity_positions()
         # Update the list of all entities
         self.aggregate_entities()
-        # Build a new kd tree to account for movement from the last tick
-        self.build_kd_tree()
-        # Update all plants then all bots
-        for array in [self.plants, self.bots, self.signals]:
-            for entity in list(array):
-                # Take care of dead entities
-                if entity.dead:
-                    # if isinstance(entity, Bot):
-                    #    print("%s has died" % str(entity))
-                    # Transfer any remaining energy back into the world
-                    if self.energy_pool is not None and entity.energy > 0:
-                        self.energy_pool += entity.energy
-                    array.remove(entity)
-                    if isinstance(entity, Bot):
-                        self.recently_dead_bots.append(entity)
-                        if entity is self.selected_bot:
-                            self.selected_bot = None
-                else:
-                    # Make sure the entity wraps around the boundaries
-                    if self.boundary_sizes:
-                        entity.x = entity.x % self.boundary_sizes[0]
-                        entity.y = entity.y % self.boundary_sizes[1]
-                    entity.step()
+        # Update the spatial index to account for movement from the last tick
+        self.spatial_index.update()
+        self.index_tick = self.tick_number
+        # Update all plants then all bots then all signals. Entities added while a kind is stepping (children)
+        # are not stepped until the next tick, but signals launched by bots are stepped this tick.
+        for store in self.stores:
+            count = len(store)
+            if store is self.plant_store and self.tick_number % self.plant_interval:
+                continue
+            if store is self.bot_store and self.brain_execution == 'wavefront':
+                self.step_brains(store, count)
+            elif store is self.plant_store and self.plant_execution == 'vectorized':
+                Plant.step_plants(self, store, np.arange(count))
+            elif store is self.plant_store and self.plant_execution == 'dormant':
+                self.dormant_plants.step(count)
+            else:
+                for entity in store.entities[:count]:
+                    if not entity.dead:
+                        entity.step()
+            store.kind.step_population(self, store, count)
+            if store is self.bot_store:
+                self.mutate_pending()
+
+    def step_brains(self, store, count):
+        # Wavefront execution of the first count bots' behaviors
+        rows = np.flatnonzero(~store.column('dead')[:count])
+        bots = [store.entities[row] for row in rows.tolist()]
+        for bot in bots:
+            bot.before_behavior()
+        step_wavefront(store, rows, bots, self.brain_budget)
+        for bot in bots:
+            bot.after_behavior()
+
+    def mutate_later(self, bot):
+        # Queue a newborn bot's brain to be mutated with the rest of this tick's offspring
+        self.pending_mutations.append(bot)
+
+    def mutate_pending(self):
+        bots = [bot for bot in self.pending_mutations if bot.world is self and bot.registered]
+        self.pending_mutations = []
+        self.mutation_engine.mutate_batch([bot.behavior for bot in bots])
+        for bot in bots:
+            # A newborn starts at its entry node, which the mutation may have moved
+            bot.behavior.current_behavior_node = bot.behavior.entry_node
+            self.genomes.release(bot.interned_genome)
+            self._adopt_brain(bot)
+
+    def wrap_entity_positions(self):
+        # Make sure every entity wraps around the boundaries
+        if self.boundary_sizes:
+            for store in self.stores:
+                for name, size in zip(('x', 'y'), self.boundary_sizes):
+                    coordinates = store.column(name)
+                    coordinates %= size
+                    # Tiny negative values can round up to the boundary itself
+                    coordinates[coordinates >= size] = 0
+
+    def remove_dead_entities(self):
+        for store in self.stores:
+            dead_rows = np.flatnonzero(store.column('dead'))
+            if len(dead_rows) == 0:
+                continue
+            self.spatial_index.remove(store, dead_rows)
+            dead_energy = store.column('energy')[dead_rows]
+            for entity in store.remove_dead():
+                if isinstance(entity, Bot):
+                    self.recently_dead_bots.append(entity)
+                    if entity.interned_genome is not None:
+                        self.genomes.release(entity.interned_genome)
+                        entity.interned_genome = None
+                    if entity is self.selected_bot:
+                        self.selected_bot = None
+                elif isinstance(entity, Signal):
+                    entity.clear_detection()
+            # Transfer any remaining energy back into the world
+            if self.energy_pool is not None:
+                self.energy_pool += dead_energy[dead_energy > 0].sum().item()
 
     def _add_plant(self, plant):
         if self.plant_limit and len(self.plants) >= self.plant_limit:
             return False
-        self.plants.append(plant)
+        self._store_entity(self.plant_store, plant)
         return True
 
+    def _insert(self, store, entities, values):
+        # Bulk version of the bookkeeping in add_entity for new entities of one store, whose column values are given
+        # as arrays. The caller keeps to the store's limit.
+        if self.boundary_sizes:
+            values['x'] = values['x'] % self.boundary_sizes[0]
+            values['y'] = values['y'] % self.boundary_sizes[1]
+        values['birthday'] = self.tick_number
+        rows = store.add_many(entities, self.next_entity_id + 1, values)
+        self.next_entity_id += len(entities)
+        self.schedule_deaths(store, np.arange(rows.start, rows.stop))
+        for entity in entities:
+            entity.world = self
+
     def _add_bot(self, bot):
         if self.bot_limit and len(self.bots) >= self.bot_limit:
             return False
-        self.bots.append(bot)
+        self._store_entity(self.bot_store, bot)
+        if bot.behavior is not None:
+            self._adopt_brain(bot)
         return True
 
+    def _adopt_brain(self, bot):
+        if self.prune_brains and not bot.behavior.genome.shared:
+            pruned = bot.behavior.prune_unreachable()
+            if pruned:
+                self.pruned_brains += 1
+                self.pruned_nodes += pruned
+        bot.interned_genome = self.genomes.intern(bot.behavior)
+
+    def species_count(self):
+        # Number of distinct brain structures among the bots in the world
+        return len(self.genomes)
+
     def _add_signal(self, signal):
-        self.signals.append(signal)
+        self._store_entity(self.signal_store, signal)
         return True
 
+    def _store_entity(self, store, entity):
+        self.next_entity_id += 1
+        row = store.add(entity, self.next_entity_id)
+        self.schedule_deaths(store, [row])
+
+    def schedule_deaths(self, store, rows):
+        # Schedule the age-out deaths of store rows from their ages and max_ages. Deaths that are already due come at
+        # the next aging.
+        columns = store.columns
+        due = columns['age_origin'][rows] + columns['max_age'][rows] + store.kind.death_age_offset
+        self.death_wheels[store].schedule(np.maximum(due, store.clock + 1), store.ids[rows])
+
+    def age_store(self, store, count):
+        # Age the first count rows of store by one tick and mark those reaching their age limit dead
+        store.advance_clock(count)
+        ids = self.death_wheels[store].pop(store.clock)
+        rows = np.fromiter((store.rows.get(entity_id, -1) for entity_id in ids.tolist()), dtype=np.intp,
+                           count=len(ids))
+        # Entities already removed, or whose age or max_age changed since they were scheduled, are skipped
+        rows = rows[rows >= 0]
+        due = store.columns['age_origin'][rows] + store.columns['max_age'][rows] + store.kind.death_age_offset
+        store.columns['dead'][rows[due <= store.clock]] = True
+        later = rows[due > store.clock]
+        if len(later):
+            self.schedule_deaths(store, later)
+
+    def get_entity(self, entity_id):
+        for store in self.stores:
+            row = store.rows.get(entity_id)
+            if row is not None:
+                return store.entities[row]
+        return None
+
     def add_entity(self, entity):
         # Note: add energy to entities before adding them, or they will be refused.
+        # Adding an entity that is already in a world returns whether it is in this one.
+        if entity.registered:
+            return entity.world is self
         if entity.energy < 0:
             return False
         if isinstance(entity, Signal):
@@ -114,22 +298,127 @@ class World:
                 entity.y = entity.y % self.boundary_sizes[1]
         return success
 
+    def add_entities(self, entities=None, positions=None, kinds=None, energies=None, behavior=None):
+        # Bulk add_entity. Pass a list of entities, or positions with kinds (a Plant or Bot class, or one class per
+        # position) to create them from, in which case bots get a copy of behavior. energies, one value for all or
+        # one per entity, is given to the entities from the energy pool in order until it runs out. Entities over
+        # bot_limit or plant_limit are refused.
+        # Returns the entities that were added.
+        if positions is not None:
+            if entities is not None:
+                raise ValueError("Pass either entities or positions, not both")
+            positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+            if isinstance(kinds, type):
+                kinds = [kinds] * len(positions)
+            if kinds is None or len(kinds) != len(positions):
+                raise ValueError("Entities created from positions need one kind per position")
+            if any(not issubclass(kind, (Plant, Bot)) for kind in kinds):
+                raise ValueError("Only plants and bots can be created from positions")
+            if behavior is None and any(issubclass(kind, Bot) for kind in kinds):
+                raise ValueError("Bots created from positions need a behavior")
+            entities = [kind(x, y, behavior_graph=behavior.return_tree_copy()) if issubclass(kind, Bot) else kind(x, y)
+                        for kind, (x, y) in zip(kinds, positions.tolist())]
+        # An entity passed more than once is only added, and given energy, at its first position
+        seen = set()
+        first = []
+        for entity in entities:
+            first.append(id(entity) not in seen)
+            seen.add(id(entity))
+        candidates = [entity for entity, is_first in zip(entities, first)
+                      if is_first and not entity.registered and entity.energy >= 0]
+        groups = {store: [] for store in self.stores}
+        for entity in candidates:
+            if isinstance(entity, Signal):
+                groups[self.signal_store].append(entity)
+            elif isinstance(entity, Plant):
+                groups[self.plant_store].append(entity)
+            elif isinstance(entity, Bot):
+                groups[self.bot_store].append(entity)
+            else:
+                raise ValueError("%s is %s. Must be either a Signal, Plant, or Bot" % (entity, type(entity)))
+        for store, limit in ((self.plant_store, self.plant_limit), (self.bot_store, self.bot_limit)):
+            if limit:
+                del groups[store][max(limit - len(store), 0):]
+        added = set(id(entity) for group in groups.values() for entity in group)
+        # Energy is granted in the order entities were passed, as repeated give_energy_to_entity calls would
+        grants = None
+        if energies is not None:
+            energies = np.asarray(energies, dtype=np.float64)
+            if energies.ndim == 0:
+                energies = np.full(len(entities), energies.item())
+            elif len(energies) != len(entities):
+                raise ValueError("Need one energy per entity, not %d for %d" % (len(energies), len(entities)))
+            if (energies < 0).any():
+                raise ValueError("Energies given to new entities must not be negative")
+            wanted = energies * [is_first and id(entity) in added for entity, is_first in zip(entities, first)]
+            if self.energy_pool is not None:
+                wanted = np.clip(self.energy_pool - (np.cumsum(wanted) - wanted), 0, wanted)
+                self.energy_pool -= wanted.sum().item()
+            grants = {id(entity): grant
+                      for entity, grant, is_first in zip(entities, wanted.tolist(), first) if is_first}
+        for store, group in groups.items():
+            if not group:
+                continue
+            values = store.detached_values(group)
+            if grants is not None:
+                values['energy'] += [grants[id(entity)] for entity in group]
+            self._insert(store, group, values)
+            if store is self.bot_store:
+                for bot in group:
+                    if bot.behavior is not None:
+                        self._adopt_brain(bot)
+        return [entity for entity in candidates if id(entity) in added]
+
     def aggregate_entities(self):
+        # Entities are listed by kind (plants, bots, signals) in store row order. Removing a dead entity moves the
+        # last row of its kind into the hole, so positions in this list are only meaningful for the current tick.
         self.all_entities = []
         for entity_list in (self.plants, self.bots, self.signals):
             self.all_entities.extend(entity_list)
 
-    def build_kd_tree(self):
-        if len(self.all_entities) > 0:
-            x_array = [p.x for p in self.all_entities]
-            y_array = [p.y for p in self.all_entities]
-            number_entities = len(self.all_entities)
-            x_array = np.array(x_array)
-            y_array = np.array(y_array)
-            x_array = np.reshape(x_array, (number_entities, 1))
-            y_array = np.reshape(y_array, (number_entities, 1))
-            point_locations = np.hstack((x_array, y_array))
-            self.kd_tree = cKDTree(point_locations, leafsize=15)
+    def _stores_for(self, kinds):
+        # Returns the stores holding the given entity classes and whether results still need an isinstance check
+        if kinds is None:
+            return None, False
+        stores = [store for store in self.stores
+                  if any(issubclass(store.kind, kind) or issubclass(kind, store.kind) for kind in kinds)]
+        return stores, any(kind not in (store.kind for store in stores) for kind in kinds)
+
+    def query_radius(self, x, y, radius, kinds=None):
+        stores, narrower = self._stores_for(kinds)
+        found = [self.all_entities[index] for index in self.spatial_index.query_radius(x, y, radius, stores)]
+        if narrower:
+            found = [entity for entity in found if isinstance(entity, kinds)]
+        return found
+
+    def query_around(self, entity, radius, kinds=None, cost=0, color=None):
+        # Find the other entities within radius of an entity, charging it cost energy, without creating a signal
+        if cost:
+            self.drain_energy_from_entity(cost, entity)
+        if self.record_effects:
+            self.effects.append(Effect(entity.x, entity.y, radius, color))
+        return [other for other in self.query_radius(entity.x, entity.y, radius, kinds) if other is not entity]
+
+    def detect_signals(self, store, count):
+        rows = np.flatnonzero(~store.column('dead')[:count])
+        if len(rows) == 0:
+            return
+        points = store.positions()[rows]
+        radii = store.column('diameter')[rows] // 2
+        results = self.spatial_index.query_radius_batch(points, radii)
+        entities = store.entities
+        # Signals are stepped after bots, so what they detect is read by bots next tick, under the next index
+        read_tick = self.tick_number + 1
+        for row, indexes in zip(rows.tolist(), results):
+            entities[row].set_detected(indexes, self.all_entities, read_tick)
+
+    def query_nearest(self, x, y, k, kinds=None):
+        stores, narrower = self._stores_for(kinds)
+        distances, indexes = self.spatial_index.query_nearest(x, y, k, stores)
+        found = [(distance, self.all_entities[index]) for distance, index in zip(distances, indexes)]
+        if narrower:
+            found = [(distance, entity) for distance, entity in found if isinstance(entity, kinds)]
+        return found
 
     def give_energy_to_entity(self, energy_to_give, entity):
         if energy_to_give >= 0:
@@ -153,6 +442,15 @@ class World:
         else:
             return False
 
+    def drain_energy_from_store(self, energy_to_drain, store, count):
+        # Vectorized drain_energy_from_entity over the first count rows of a store
+        energy = store.column('energy')[:count]
+        drained = np.minimum(energy, energy_to_drain)
+        store.column('dead')[:count] |= energy <= energy_to_drain
+        energy -= drained
+        if self.energy_pool is not None:
+            self.energy_pool += drained.sum().item()
+
     def transfer_energy_between_entities(self, energy_to_transfer, *, donor, recipient):
         if recipient.dead or donor.dead:
             return False
@@ -180,6 +478,20 @@ class World:
             y_diff /= distance
         return x_diff, y_diff
 
+    def get_unit_vectors_to_points(self, start_x, start_y, target_x, target_y):
+        # Vectorized get_unit_vector_to_point over arrays of start and target coordinates
+        x_diff, y_diff = target_x - start_x, target_y - start_y
+        if self.boundary_sizes:
+            x_diff = np.where(x_diff > self.half_boundaries[0], x_diff - self.boundary_sizes[0], x_diff)
+            x_diff = np.where(x_diff < -self.half_boundaries[0], x_diff + self.boundary_sizes[0], x_diff)
+            y_diff = np.where(y_diff > self.half_boundaries[1], y_diff - self.boundary_sizes[1], y_diff)
+            y_diff = np.where(y_diff < -self.half_boundaries[1], y_diff + self.boundary_sizes[1], y_diff)
+        distance = np.sqrt((x_diff**2) + (y_diff**2))
+        moving = distance > 0
+        x_diff[moving] /= distance[moving]
+        y_diff[moving] /= distance[moving]
+        return x_diff, y_diff
+
     def populate(self, number_bots, bot_energy, default_behavior=None, behavior_size=8):
         if self.energy_pool is not None:
             if bot_energy * number_bots > self.energy_pool:
@@ -189,38 +501,66 @@ class World:
                 print("Not enough free energy for even a single bot.")
                 print("Deleting food until there is enough free energy.")
                 while (number_bots * bot_energy) > self.energy_pool:
-                    plant = self.plants.pop()
+                    plant = self.plants[-1]
+                    self.spatial_index.remove(self.plant_store, [plant._row])
+                    self.plant_store.pop()
                     self.energy_pool += plant.energy
-        # Populate the world with bots
-        for bot in range(0, number_bots):
+        # Populate the world with as many bots as the pool can give bot_energy to
+        if self.energy_pool is not None and bot_energy > 0:
+            number_bots = min(number_bots, int(self.energy_pool // bot_energy))
+        if self.boundary_sizes:
+            positions = self.rng.integers(0, self.boundary_sizes, size=(number_bots, 2), endpoint=True)
+        else:
+            positions = self.rng.integers(-50, 50, size=(number_bots, 2), endpoint=True)
+        bots = []
+        for x, y in positions.tolist():
             if not default_behavior:
                 behavior = BehaviorGraph()
-                behavior.generate_random_graph(behavior_size)
+                behavior.generate_random_graph(behavior_size, rng=self.mutation_engine)
             else:
                 behavior = default_behavior.return_tree_copy()
-            if self.boundary_sizes:
-                x = randint(0, self.boundary_sizes[0])
-                y = randint(0, self.boundary_sizes[1])
-            else:
-                x = randint(-50, 50)
-                y = randint(-50, 50)
-            bot = Bot(x, y, 1, behavior_graph=behavior)
-            if self.energy_pool is not None and self.energy_pool < bot_energy:
-                break
-            self.add_entity(bot)
-            self.give_energy_to_entity(bot_energy, bot)
+            bots.append(Bot(x, y, 1, behavior_graph=behavior))
+        self.add_entities(bots, energies=bot_energy)
         return True
 
 
+class GCPauseTimer:
+    # Adds up the time the garbage collector pauses the program for, read back in milliseconds with take()
+    def __init__(self):
+        self.paused = 0.0
+        self._started = None
+        gc.callbacks.append(self._callback)
+
+    def _callback(self, phase, info):
+        if phase == 'start':
+            self._started = time.perf_counter()
+        elif self._started is not None:
+            self.paused += time.perf_counter() - self._started
+            self._started = None
+
+    def take(self):
+        paused, self.paused = self.paused, 0.0
+        return paused * 1000
+
+    def stop(self):
+        if self._callback in gc.callbacks:
+            gc.callbacks.remove(self._callback)
+
+
 class WorldWatcher:
     # TODO: Have info polling reduce data size through averaging when it becomes too large
-    def __init__(self, world):
+    def __init__(self, world, time_gc=False):
         # TODO: Get time from world
         self.start_time = time.time()
         self.world = world
         self.plant_numbers = []
         self.bot_numbers = []
         self.signal_numbers = []
+        self.species_numbers = []
+        # With time_gc, milliseconds spent in garbage collection between polls. The timer hooks into every
+        # collection until the watcher is closed.
+        self.gc_timer = GCPauseTimer() if time_gc else None
+        self.gc_pause_times = []
         # Create a dummy 'best bot' for now
         self.best_bot = Bot(0, 0, 0, name='Dummy_Bot')
         self.best_bot.birthday = 0
@@ -246,10 +586,30 @@ class WorldWatcher:
         for data_list, world_list in ((self.plant_numbers, self.world.plants), (self.bot_numbers, self.world.bots),
                                       (self.signal_numbers, self.world.signals)):
             data_list.append(len(world_list))
+        self.species_numbers.append(self.world.species_count())
+        if self.gc_timer is not None:
+            self.gc_pause_times.append(self.gc_timer.take())
         for bot in self.world.recently_dead_bots:
             # Compare the recently deceased bot to the current best and return the better
             self.best_bot = self.bot_compare_function(self.best_bot, bot)
 
+    def accuracy_report(self, reference):
+        # Compare the population curves polled by this watcher with those of a reference watcher, e.g. one watching
+        # a full-rate run of the same world. Curves are compared poll by poll over the polls both have.
+        report = {}
+        for name in ('plant_numbers', 'bot_numbers', 'signal_numbers', 'species_numbers'):
+            curve, reference_curve = getattr(self, name), getattr(reference, name)
+            length = min(len(curve), len(reference_curve))
+            if length == 0:
+                raise ValueError("Both watchers need to have polled their worlds to compare %s" % name)
+            curve = np.asarray(curve[:length], dtype=np.float64)
+            reference_curve = np.asarray(reference_curve[:length], dtype=np.float64)
+            reference_mean = reference_curve.mean()
+            error = np.abs(curve - reference_curve) / max(reference_mean, 1)
+            report[name] = CurveAccuracy(curve.mean().item(), reference_mean.item(), error.mean().item(),
+                                         error.max().item())
+        return report
+
     @staticmethod
     def default_bot_compare(first_bot, second_bot):
         if first_bot.peak_energy > second_bot.peak_energy:
@@ -257,7 +617,13 @@ class WorldWatcher:
         else:
             return second_bot
 
+    def close(self):
+        if self.gc_timer is not None:
+            self.gc_timer.stop()
+            self.gc_timer = None
+
     def save_metrics(self):
+        self.close()
         self.graph_population_data()
         self.save_champion_bot_data()
         print("Total elapsed seconds:", round(time.time() - self.start_time, 2), "seconds.")